@@ -0,0 +1,78 @@
+# benchmarks/broadcast_encode.py
+"""
+Микробенчмарк кодирования сообщений при рассылке по комнате.
+
+Сравнивает кодирование сообщения для каждого получателя с кодированием одного
+кадра на всю комнату. Оба пути используют один кодировщик (frames.encode_frame)
+и одинаково ставят кадр в очередь получателя, как Connection.send, поэтому
+разница - только от однократного кодирования.
+
+Запуск: python benchmarks/broadcast_encode.py [--messages N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "chat"))
+
+from frames import encode_frame, orjson  # noqa: E402
+
+ROOM_SIZES = (10, 100, 1000)
+
+MESSAGE = {
+    "type": "message",
+    "user": "user@example.com",
+    "message": "Привет всем! " * 8,
+}
+
+
+def drain(queues):
+    """Разбор очередей, как это делает задача отправки каждого подключения"""
+    for queue in queues:
+        while not queue.empty():
+            queue.get_nowait()
+
+
+def per_recipient(room_size: int, messages: int) -> float:
+    """Прежний путь: кадр кодируется для каждого получателя"""
+    queues = [asyncio.Queue() for _ in range(room_size)]
+    start = time.process_time()
+    for _ in range(messages):
+        for queue in queues:
+            queue.put_nowait((time.monotonic(), encode_frame(MESSAGE)))
+        drain(queues)
+    return time.process_time() - start
+
+
+def serialize_once(room_size: int, messages: int) -> float:
+    """Новый путь: один кадр на сообщение, получателям уходит ссылка на него"""
+    queues = [asyncio.Queue() for _ in range(room_size)]
+    start = time.process_time()
+    for _ in range(messages):
+        frame = encode_frame(MESSAGE)
+        for queue in queues:
+            queue.put_nowait((time.monotonic(), frame))
+        drain(queues)
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"encoder: {'orjson' if orjson is not None else 'json'}, messages: {args.messages}")
+    print(f"{'room':>6} {'before us/msg':>14} {'after us/msg':>13} {'speedup':>8}")
+    for room_size in ROOM_SIZES:
+        before = per_recipient(room_size, args.messages)
+        after = serialize_once(room_size, args.messages)
+        print(
+            f"{room_size:>6} {before / args.messages * 1e6:>14.1f} "
+            f"{after / args.messages * 1e6:>13.1f} {before / after:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
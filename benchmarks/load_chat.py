@@ -0,0 +1,310 @@
+# benchmarks/load_chat.py
+"""
+Нагрузочный бенчмарк рассылки сообщений в chat.
+
+Поднимает заглушку API website, запускает chat/main.py через uvicorn,
+подключает --clients WebSocket-клиентов в --rooms комнат, проходит
+авторизацию с локально выпущенными токенами и отправляет сообщения
+с частотой --rate в секунду в течение --duration секунд.
+
+Результат (скорость подключения, задержка доставки p50/p95/p99,
+сообщений в секунду, RSS на подключение) печатается в JSON и,
+с --output, сохраняется в файл для сравнения прогонов.
+
+Запуск: python benchmarks/load_chat.py --clients 1000 --rooms 10 --rate 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import websockets
+from aiohttp import web
+
+CHAT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chat")
+
+# Должны совпадать с ключом в chat/main.py
+SECRET_KEY = "your_secret_key"
+ALGORITHM = "HS256"
+
+BENCH_PREFIX = "bench "
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes(pid: int):
+    """RSS процесса из /proc, None на системах без procfs"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values, fraction: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def mint_token(email: str, room_name: str) -> str:
+    return jwt.encode(
+        {
+            "user_id": 0,
+            "email": email,
+            "chat_name": room_name,
+            "exp": datetime.now(timezone.utc) + timedelta(hours=1),
+        },
+        SECRET_KEY,
+        algorithm=ALGORITHM,
+    )
+
+
+async def start_website_stub(rooms, port: int) -> web.AppRunner:
+    """Заглушка API website, которое chat вызывает при работе"""
+    room_set = set(rooms)
+
+    async def names(request):
+        return web.json_response({"names": sorted(room_set)})
+
+    async def exists(request):
+        return web.json_response({"exists": request.match_info["room_name"] in room_set})
+
+    async def exists_batch(request):
+        body = await request.json()
+        return web.json_response({"exists": {name: name in room_set for name in body["names"]}})
+
+    async def store_messages(request):
+        body = await request.json()
+        return web.json_response({"stored": len(body["messages"])})
+
+    app = web.Application()
+    app.router.add_get("/api/internal/chats/names", names)
+    app.router.add_get("/api/chat/{room_name}/exists", exists)
+    app.router.add_post("/api/chats/exists", exists_batch)
+    app.router.add_post("/api/internal/messages", store_messages)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def wait_for_port(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"chat did not start on port {port}")
+
+
+class Client:
+    """Участник комнаты: подключение и учет задержек доставки"""
+
+    def __init__(self, index: int, room_name: str, stats: "Stats"):
+        self.index = index
+        self.room_name = room_name
+        self.email = f"bench{index}@example.com"
+        self.stats = stats
+        self.websocket = None
+        self.reader = None
+
+    async def connect(self, url: str):
+        while True:
+            try:
+                self.websocket = await websockets.connect(url, max_queue=None)
+                break
+            except websockets.InvalidStatus as e:
+                # Перегруженный chat отказывает до рукопожатия и подсказывает, когда повторить
+                if e.response.status_code != 503:
+                    raise
+                self.stats.rejected += 1
+                await asyncio.sleep(float(e.response.headers.get("Retry-After", "1")))
+        await self.websocket.send(json.dumps({
+            "type": "authorization",
+            "token": mint_token(self.email, self.room_name),
+        }))
+        # Первый кадр после авторизации - состав комнаты
+        await self.websocket.recv()
+        self.reader = asyncio.create_task(self._read_loop())
+
+    async def send(self) -> bool:
+        try:
+            await self.websocket.send(json.dumps({
+                "type": "message",
+                "message": f"{BENCH_PREFIX}{time.perf_counter_ns()}",
+            }))
+        except websockets.ConnectionClosed:
+            # Отключенный сервером клиент (например, медленный) учитывается в disconnects
+            return False
+        return True
+
+    async def _read_loop(self):
+        try:
+            async for raw in self.websocket:
+                data = json.loads(raw)
+                self.stats.frames += 1
+                if isinstance(data, dict) and data.get("type") == "ping":
+                    await self.websocket.send('{"type":"pong"}')
+                    continue
+                for item in data if isinstance(data, list) else (data,):
+                    self.stats.frame(item)
+        except websockets.ConnectionClosed:
+            self.stats.disconnects += 1
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        await self.websocket.close()
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = array("d")
+        self.delivered = 0
+        self.frames = 0
+        self.disconnects = 0
+        # Подключения, отклоненные допуском chat и повторенные после Retry-After
+        self.rejected = 0
+
+    def frame(self, item: dict):
+        text = item.get("message")
+        if item.get("type") == "message" and isinstance(text, str) and text.startswith(BENCH_PREFIX):
+            sent_at = int(text[len(BENCH_PREFIX):])
+            self.latencies.append((time.perf_counter_ns() - sent_at) / 1e6)
+            self.delivered += 1
+
+
+async def run(args) -> dict:
+    rooms = [f"bench_room_{index:04d}" for index in range(args.rooms)]
+    stub_port = free_port()
+    chat_port = free_port()
+    stub = await start_website_stub(rooms, stub_port)
+
+    env = dict(os.environ, WEBSITE_URL=f"http://127.0.0.1:{stub_port}")
+    # Ограничения частоты сообщений исказили бы замер рассылки, вернуть их можно через --env
+    for key in ("RATE_LIMIT_CONNECTION", "RATE_LIMIT_USER", "RATE_LIMIT_ROOM"):
+        env[key] = "0"
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    chat = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(chat_port), "--log-level", "warning",
+         "--ws", "protocol:ChatWebSocketProtocol"],
+        cwd=CHAT_DIR,
+        env=env,
+    )
+    try:
+        await wait_for_port(chat_port)
+        rss_before = rss_bytes(chat.pid)
+
+        stats = Stats()
+        clients = [Client(index, rooms[index % len(rooms)], stats) for index in range(args.clients)]
+        semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+        async def connect(client: Client):
+            async with semaphore:
+                await client.connect(f"ws://127.0.0.1:{chat_port}/ws/{client.room_name}")
+
+        connect_started = time.perf_counter()
+        await asyncio.gather(*(connect(client) for client in clients))
+        connect_seconds = time.perf_counter() - connect_started
+        rss_after = rss_bytes(chat.pid)
+
+        # Сообщения отправляются равномерно с заданной частотой случайными клиентами
+        total = int(args.rate * args.duration)
+        sent = 0
+        send_started = time.perf_counter()
+        for index in range(total):
+            delay = send_started + index / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            sent += await random.choice(clients).send()
+        send_seconds = time.perf_counter() - send_started
+
+        # Ждем доставки хвоста
+        await asyncio.sleep(args.drain)
+        expected = sent * args.clients / args.rooms
+
+        await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+    finally:
+        chat.terminate()
+        chat.wait(timeout=10)
+        await stub.cleanup()
+
+    latencies = list(stats.latencies)
+    rss_per_connection = None
+    if rss_before is not None and rss_after is not None:
+        rss_per_connection = (rss_after - rss_before) / args.clients
+    return {
+        "config": {
+            "clients": args.clients,
+            "rooms": args.rooms,
+            "rate": args.rate,
+            "duration": args.duration,
+            "env": args.env,
+        },
+        "connect_seconds": connect_seconds,
+        "connects_per_second": args.clients / connect_seconds,
+        "messages_sent": sent,
+        "send_seconds": send_seconds,
+        "deliveries": stats.delivered,
+        "deliveries_expected": expected,
+        "deliveries_per_second": stats.delivered / (send_seconds + args.drain),
+        "frames_received": stats.frames,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies, default=None),
+        },
+        "disconnects": stats.disconnects,
+        "rejected_handshakes": stats.rejected,
+        "rss_per_connection_bytes": rss_per_connection,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=100.0, help="сообщений в секунду всего")
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд отправки")
+    parser.add_argument("--drain", type=float, default=2.0, help="секунд ожидания хвоста доставки")
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переменная окружения для процесса chat")
+    parser.add_argument("--output", help="файл для результата в JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# chat/admission.py
+import os
+import random
+from typing import Optional
+
+from metrics import ADMISSION_REJECTED
+from registry import ConnectionRegistry
+
+# Пределы подключений воркера: всего, в одной комнате и у одного пользователя, 0 - без ограничения
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", "10000"))
+MAX_ROOM_CONNECTIONS = int(os.getenv("MAX_ROOM_CONNECTIONS", "1000"))
+MAX_USER_CONNECTIONS = int(os.getenv("MAX_USER_CONNECTIONS", "10"))
+# Одновременных входов от запроса до входа в комнату: всплеск переподключений
+# ждет у клиентов, а не в event loop вместе с уже подключенными
+MAX_PENDING_HANDSHAKES = int(os.getenv("MAX_PENDING_HANDSHAKES", "256"))
+# Сколько ждать кадр авторизации (секунды): молчащий клиент не держит место входа
+HANDSHAKE_TIMEOUT = float(os.getenv("HANDSHAKE_TIMEOUT", "10"))
+# Диапазон Retry-After для отклоненных подключений (целые секунды)
+ADMISSION_RETRY_MIN_DELAY = int(os.getenv("ADMISSION_RETRY_MIN_DELAY", "1"))
+ADMISSION_RETRY_MAX_DELAY = int(os.getenv("ADMISSION_RETRY_MAX_DELAY", "5"))
+
+# Try Again Later: отказ после принятия (предел пользователя или комнаты заполнилась во время входа)
+ADMISSION_REJECT_CODE = 1013
+HANDSHAKE_TIMEOUT_CODE = 4010
+
+
+class DenialResponseMixin:
+    """Для протокола uvicorn: отказ HTTP-ответом (503 с Retry-After) завершает рукопожатие.
+    Без этого uvicorn пишет в лог ложную ошибку на каждое отклоненное подключение"""
+
+    async def send(self, message):
+        await super().send(message)
+        if message["type"] == "websocket.http.response.body" and not message.get("more_body", False):
+            self.handshake_complete = True
+
+
+class Handshake:
+    """Место входа; освобождается один раз - после входа в комнату или при обрыве"""
+
+    __slots__ = ("admission", "active")
+
+    def __init__(self, admission: "Admission"):
+        self.admission = admission
+        self.active = True
+        admission.pending += 1
+
+    def done(self):
+        if self.active:
+            self.active = False
+            self.admission.pending -= 1
+
+
+class Admission:
+    """Допуск новых подключений: дешевые проверки до accept, остальное - сразу после токена"""
+
+    def __init__(self, registry: ConnectionRegistry):
+        self.registry = registry
+        self.pending = 0
+
+    def check(self, room_name: str) -> Optional[str]:
+        """До accept: None - подключение можно принимать, иначе причина отказа"""
+        if MAX_PENDING_HANDSHAKES and self.pending >= MAX_PENDING_HANDSHAKES:
+            reason = "pending"
+        elif MAX_CONNECTIONS and len(self.registry) + self.pending >= MAX_CONNECTIONS:
+            reason = "process"
+        elif MAX_ROOM_CONNECTIONS and self.registry.count(room_name) >= MAX_ROOM_CONNECTIONS:
+            reason = "room"
+        else:
+            return None
+        ADMISSION_REJECTED.labels(reason).inc()
+        return reason
+
+    def check_member(self, room_name: str, user_email: str) -> Optional[str]:
+        """После проверки токена, когда известен пользователь"""
+        if MAX_ROOM_CONNECTIONS and self.registry.count(room_name) >= MAX_ROOM_CONNECTIONS:
+            reason = "room"
+        elif MAX_USER_CONNECTIONS and len(self.registry.user(user_email)) >= MAX_USER_CONNECTIONS:
+            reason = "user"
+        else:
+            return None
+        ADMISSION_REJECTED.labels(reason).inc()
+        return reason
+
+    def handshake(self) -> Handshake:
+        return Handshake(self)
+
+    @staticmethod
+    def retry_after() -> int:
+        """Случайная задержка, чтобы отклоненные клиенты не вернулись одновременно"""
+        return random.randint(ADMISSION_RETRY_MIN_DELAY, ADMISSION_RETRY_MAX_DELAY)
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "connections": len(self.registry)}
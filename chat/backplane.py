@@ -0,0 +1,288 @@
+# chat/backplane.py
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, NamedTuple, Set, Tuple
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# local - рассылка внутри процесса, redis://host:port/db - между воркерами
+BACKPLANE_URL = os.getenv("BACKPLANE_URL", "local")
+BACKPLANE_CHANNEL_PREFIX = os.getenv("BACKPLANE_CHANNEL_PREFIX", "chat:room:")
+BACKPLANE_SEQ_PREFIX = os.getenv("BACKPLANE_SEQ_PREFIX", "chat:seq:")
+# Время жизни счетчика последовательности комнаты в Redis (секунды)
+BACKPLANE_SEQ_TTL = int(os.getenv("BACKPLANE_SEQ_TTL", "86400"))
+BACKPLANE_PRESENCE_PREFIX = os.getenv("BACKPLANE_PRESENCE_PREFIX", "chat:presence:")
+# Время жизни состава комнаты без изменений, ограничивает срок записей упавшего воркера
+BACKPLANE_PRESENCE_TTL = int(os.getenv("BACKPLANE_PRESENCE_TTL", "86400"))
+# Общий канал создания и удаления комнат, на него подписаны все воркеры
+BACKPLANE_ROOMS_CHANNEL = os.getenv("BACKPLANE_ROOMS_CHANNEL", "chat:rooms")
+# Примененные события комнат из outbox website: повтор пакета на любом воркере пропускается
+BACKPLANE_EVENT_PREFIX = os.getenv("BACKPLANE_EVENT_PREFIX", "chat:room-event:")
+BACKPLANE_EVENT_TTL = int(os.getenv("BACKPLANE_EVENT_TTL", "86400"))
+# Сколько id событий помнит процесс без Redis
+BACKPLANE_EVENT_DEDUP_SIZE = int(os.getenv("BACKPLANE_EVENT_DEDUP_SIZE", "10000"))
+
+# Виды событий комнаты
+MESSAGE = "message"
+CLOSE = "close"
+
+
+class RoomEvent(NamedTuple):
+    """Событие комнаты: готовый кадр и, для CLOSE, код закрытия подключений.
+    seq - номер сообщения в комнате, 0 - номер назначает получатель"""
+    kind: str
+    frame: str
+    code: int = 1000
+    reason: str = ""
+    seq: int = 0
+
+
+# deliver(room_name, event) -> число локальных получателей
+Deliver = Callable[[str, RoomEvent], int]
+IsLocal = Callable[[str], bool]
+# room_state(room_name, exists) - комната создана или удалена
+RoomState = Callable[[str, bool], None]
+# (вошедшие, вышедшие, участников в комнате)
+PresenceDelta = Tuple[List[str], List[str], int]
+
+
+def apply_presence(members: Dict[str, int], changes: Dict[str, int]) -> PresenceDelta:
+    """Применяет изменения числа подключений по email к составу комнаты.
+    Вошедшим или вышедшим пользователь считается при переходе через ноль"""
+    joined, left = [], []
+    for email, delta in changes.items():
+        before = members.get(email, 0)
+        after = before + delta
+        if after > 0:
+            members[email] = after
+        else:
+            members.pop(email, None)
+        if before <= 0 < after:
+            joined.append(email)
+        elif after <= 0 < before:
+            left.append(email)
+    return joined, left, len(members)
+
+
+class LocalBackplane:
+    """Рассылка внутри одного процесса, поведение по умолчанию"""
+
+    def __init__(self):
+        self.deliver: Deliver = None
+        self.room_state: RoomState = None
+        # {room_name: {email: число подключений}}
+        self.presence: Dict[str, Dict[str, int]] = {}
+        # {event_id: None} - старые вытесняются
+        self.events: OrderedDict = OrderedDict()
+
+    async def start(self, deliver: Deliver, is_local: IsLocal, room_state: RoomState):
+        self.deliver = deliver
+        self.room_state = room_state
+
+    async def stop(self):
+        pass
+
+    async def acquire_room(self, room_name: str):
+        pass
+
+    def release_room(self, room_name: str):
+        pass
+
+    async def publish(self, room_name: str, event: RoomEvent) -> int:
+        return self.deliver(room_name, event)
+
+    async def publish_room_state(self, room_name: str, exists: bool):
+        self.room_state(room_name, exists)
+
+    async def event_applied(self, event_id: int) -> bool:
+        return event_id in self.events
+
+    async def mark_event_applied(self, event_id: int):
+        self.events[event_id] = None
+        if len(self.events) > BACKPLANE_EVENT_DEDUP_SIZE:
+            self.events.popitem(last=False)
+
+    async def presence_update(self, room_name: str, changes: Dict[str, int]) -> PresenceDelta:
+        members = self.presence.setdefault(room_name, {})
+        delta = apply_presence(members, changes)
+        if not members:
+            del self.presence[room_name]
+        return delta
+
+    async def presence_members(self, room_name: str) -> List[str]:
+        return list(self.presence.get(room_name, ()))
+
+    async def presence_counts(self, room_names: Iterable[str]) -> Dict[str, int]:
+        return {name: len(self.presence.get(name, ())) for name in room_names}
+
+    async def presence_clear(self, room_name: str):
+        self.presence.pop(room_name, None)
+
+
+# Номер сообщения и публикация одной атомарной операцией, чтобы порядок
+# номеров совпадал с порядком доставки на всех воркерах
+PUBLISH_SCRIPT = r"""
+local seq = 0
+if ARGV[2] == '1' then
+    seq = redis.call('INCR', KEYS[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+end
+return redis.call('PUBLISH', KEYS[1], seq .. '\n' .. ARGV[1])
+"""
+
+# Состав комнаты - хэш {email: число подключений} на все воркеры, переходы через ноль
+# считаются атомарно, чтобы вход и выход одного пользователя на разных воркерах не терялись
+PRESENCE_SCRIPT = r"""
+local joined, left = {}, {}
+for i = 2, #ARGV, 2 do
+    local email = ARGV[i]
+    local before = tonumber(redis.call('HGET', KEYS[1], email) or '0')
+    local after = before + tonumber(ARGV[i + 1])
+    if after > 0 then
+        redis.call('HSET', KEYS[1], email, after)
+    else
+        redis.call('HDEL', KEYS[1], email)
+    end
+    if before <= 0 and after > 0 then
+        table.insert(joined, email)
+    elseif before > 0 and after <= 0 then
+        table.insert(left, email)
+    end
+end
+local count = redis.call('HLEN', KEYS[1])
+if count > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return {joined, left, count}
+"""
+
+
+class RedisBackplane:
+    """Рассылка между воркерами через Redis pub/sub: канал на комнату,
+    воркер подписан только на комнаты, где у него есть участники или буфер истории"""
+
+    def __init__(self, url: str):
+        if aioredis is None:
+            raise RuntimeError("BACKPLANE_URL requires the redis package")
+        self.redis = aioredis.from_url(url)
+        self.pubsub = self.redis.pubsub()
+        self.deliver: Deliver = None
+        self.is_local: IsLocal = None
+        self.room_state: RoomState = None
+        self._active: Set[str] = set()
+        self._lock = asyncio.Lock()
+        self._reader: asyncio.Task = None
+        self._publish = self.redis.register_script(PUBLISH_SCRIPT)
+        self._presence = self.redis.register_script(PRESENCE_SCRIPT)
+
+    async def start(self, deliver: Deliver, is_local: IsLocal, room_state: RoomState):
+        self.deliver = deliver
+        self.is_local = is_local
+        self.room_state = room_state
+        await self.pubsub.subscribe(BACKPLANE_ROOMS_CHANNEL)
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def stop(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        await self.pubsub.aclose()
+        await self.redis.aclose()
+
+    async def acquire_room(self, room_name: str):
+        """Подписка на комнату, которая стала нужна этому воркеру"""
+        await self._sync(room_name)
+
+    def release_room(self, room_name: str):
+        """Комната могла стать ненужной: отписка выполняется в фоне"""
+        asyncio.create_task(self._sync(room_name))
+
+    async def _sync(self, room_name: str):
+        # Приводим подписку к текущему состоянию комнаты, порядок вызовов не важен
+        async with self._lock:
+            wanted = self.is_local(room_name)
+            channel = BACKPLANE_CHANNEL_PREFIX + room_name
+            try:
+                if wanted and room_name not in self._active:
+                    await self.pubsub.subscribe(channel)
+                    self._active.add(room_name)
+                elif not wanted and room_name in self._active:
+                    await self.pubsub.unsubscribe(channel)
+                    self._active.discard(room_name)
+            except Exception as e:
+                logger.error(f"Error syncing backplane subscription for {room_name}: {e}")
+
+    async def publish(self, room_name: str, event: RoomEvent) -> int:
+        header = json.dumps([event.kind, event.code, event.reason], ensure_ascii=False)
+        return await self._publish(
+            keys=[BACKPLANE_CHANNEL_PREFIX + room_name, BACKPLANE_SEQ_PREFIX + room_name],
+            args=[f"{header}\n{event.frame}", "1" if event.kind == MESSAGE else "0", BACKPLANE_SEQ_TTL],
+        )
+
+    async def publish_room_state(self, room_name: str, exists: bool):
+        await self.redis.publish(BACKPLANE_ROOMS_CHANNEL, json.dumps([room_name, exists], ensure_ascii=False))
+
+    async def event_applied(self, event_id: int) -> bool:
+        return bool(await self.redis.exists(f"{BACKPLANE_EVENT_PREFIX}{event_id}"))
+
+    async def mark_event_applied(self, event_id: int):
+        await self.redis.set(f"{BACKPLANE_EVENT_PREFIX}{event_id}", 1, ex=BACKPLANE_EVENT_TTL)
+
+    async def presence_update(self, room_name: str, changes: Dict[str, int]) -> PresenceDelta:
+        args = [BACKPLANE_PRESENCE_TTL]
+        for email, delta in changes.items():
+            args += [email, delta]
+        joined, left, count = await self._presence(keys=[BACKPLANE_PRESENCE_PREFIX + room_name], args=args)
+        return [email.decode() for email in joined], [email.decode() for email in left], count
+
+    async def presence_members(self, room_name: str) -> List[str]:
+        return [email.decode() for email in await self.redis.hkeys(BACKPLANE_PRESENCE_PREFIX + room_name)]
+
+    async def presence_counts(self, room_names: Iterable[str]) -> Dict[str, int]:
+        names = list(room_names)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for name in names:
+                pipe.hlen(BACKPLANE_PRESENCE_PREFIX + name)
+            counts = await pipe.execute()
+        return dict(zip(names, counts))
+
+    async def presence_clear(self, room_name: str):
+        await self.redis.delete(BACKPLANE_PRESENCE_PREFIX + room_name)
+
+    async def _read_loop(self):
+        prefix_length = len(BACKPLANE_CHANNEL_PREFIX)
+        while True:
+            try:
+                # Канал комнат подписан всегда, поэтому читать есть откуда
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                channel = message["channel"].decode()
+                if channel == BACKPLANE_ROOMS_CHANNEL:
+                    room_name, exists = json.loads(message["data"])
+                    self.room_state(room_name, exists)
+                    continue
+                seq, header, frame = message["data"].decode().split("\n", 2)
+                kind, code, reason = json.loads(header)
+                self.deliver(channel[prefix_length:], RoomEvent(kind, frame, code, reason, int(seq)))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error reading from backplane: {e}")
+                await asyncio.sleep(1.0)
+
+
+def create_backplane(url: str = BACKPLANE_URL):
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackplane(url)
+    return LocalBackplane()
+
+
+backplane = create_backplane()
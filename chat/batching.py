@@ -0,0 +1,56 @@
+# chat/batching.py
+import asyncio
+import os
+from typing import Callable, Dict, List
+
+from frames import batch_frame
+from metrics import BATCH_FRAMES
+
+# Окно сбора кадров комнаты (секунды) и предел кадров в одном массиве
+ROOM_BATCH_WINDOW = float(os.getenv("ROOM_BATCH_WINDOW", "0.005"))
+ROOM_BATCH_MAX_FRAMES = int(os.getenv("ROOM_BATCH_MAX_FRAMES", "64"))
+# Комнаты с пакетной отправкой через запятую, * - все комнаты
+ROOM_BATCH_ROOMS = {name.strip() for name in os.getenv("ROOM_BATCH_ROOMS", "").split(",") if name.strip()}
+# Пакетная отправка для комнат с не меньшим числом локальных участников, 0 - выключено
+ROOM_BATCH_MIN_CLIENTS = int(os.getenv("ROOM_BATCH_MIN_CLIENTS", "0"))
+
+# fan_out(room_name, frame) -> число получателей
+FanOut = Callable[[str, str], int]
+
+
+class RoomBatcher:
+    """Сбор кадров комнаты за окно ROOM_BATCH_WINDOW в один кадр-массив,
+    чтобы в загруженной комнате на каждого получателя уходил один кадр вместо пачки"""
+
+    def __init__(self, fan_out: FanOut):
+        self.fan_out = fan_out
+        self.pending: Dict[str, List[str]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+
+    def enabled(self, room_name: str, clients: int) -> bool:
+        if "*" in ROOM_BATCH_ROOMS or room_name in ROOM_BATCH_ROOMS:
+            return True
+        return 0 < ROOM_BATCH_MIN_CLIENTS <= clients
+
+    def add(self, room_name: str, frame: str):
+        frames = self.pending.get(room_name)
+        if frames is None:
+            frames = self.pending[room_name] = []
+            self._timers[room_name] = asyncio.get_running_loop().call_later(
+                ROOM_BATCH_WINDOW, self.flush, room_name
+            )
+        frames.append(frame)
+        if len(frames) >= ROOM_BATCH_MAX_FRAMES:
+            self.flush(room_name)
+
+    def flush(self, room_name: str):
+        """Отправка накопленного: вызывается по таймеру, по размеру и перед входом или закрытием"""
+        timer = self._timers.pop(room_name, None)
+        if timer is not None:
+            timer.cancel()
+        frames = self.pending.pop(room_name, None)
+        if not frames:
+            return
+        BATCH_FRAMES.observe(len(frames))
+        # Одиночный кадр уходит как есть
+        self.fan_out(room_name, frames[0] if len(frames) == 1 else batch_frame(frames))
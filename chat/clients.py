@@ -0,0 +1,26 @@
+# chat/clients.py
+import os
+
+import httpx
+
+WEBSITE_URL = os.getenv("WEBSITE_URL", "http://website:8000")
+
+# Параметры пула соединений к website
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "5"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "2"))
+
+
+def create_website_client() -> httpx.AsyncClient:
+    """Общий клиент к website с keep-alive пулом, создается один раз в lifespan"""
+    return httpx.AsyncClient(
+        base_url=WEBSITE_URL,
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
@@ -0,0 +1,107 @@
+# chat/codec.py
+import json
+import os
+from typing import NamedTuple, Optional, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from metrics import INVALID_FRAMES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Предел входящего кадра (символов или байт) и текста одного сообщения (символов)
+INBOUND_MAX_FRAME_SIZE = int(os.getenv("INBOUND_MAX_FRAME_SIZE", "16384"))
+MAX_MESSAGE_LENGTH = int(os.getenv("MAX_MESSAGE_LENGTH", "4000"))
+
+# Коды закрытия: кадр больше предела (стандартный Message Too Big) и неверный кадр
+FRAME_TOO_LARGE_CODE = 1009
+INVALID_FRAME_CODE = 4009
+# Коды ошибок авторизации, как и раньше: первый кадр не авторизация, нет токена
+INVALID_AUTHORIZATION_CODE = 4000
+MISSING_TOKEN_CODE = 4001
+
+
+class FrameError(Exception):
+    """Кадр отклонен, подключение закрывается с кодом code"""
+
+    def __init__(self, code: int, reason: str):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+
+
+class Authorization(NamedTuple):
+    """Первый кадр клиента: токен чата или токен возобновления и номер последнего сообщения"""
+    token: str
+    last_seq: Optional[int]
+
+
+class ChatMessage(NamedTuple):
+    text: str
+
+
+class Pong(NamedTuple):
+    pass
+
+
+PONG = Pong()
+
+ClientFrame = Union[ChatMessage, Pong]
+
+
+async def receive_frame(websocket: WebSocket) -> Union[str, bytes]:
+    """Сырой кадр без разбора, чтобы размер проверялся до парсера"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    text = message.get("text")
+    if text is not None:
+        return text
+    return message.get("bytes") or b""
+
+
+def _parse(raw: Union[str, bytes]) -> dict:
+    if len(raw) > INBOUND_MAX_FRAME_SIZE:
+        INVALID_FRAMES.labels("too_large").inc()
+        raise FrameError(FRAME_TOO_LARGE_CODE, "Frame too large")
+    try:
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError:
+        INVALID_FRAMES.labels("malformed").inc()
+        raise FrameError(INVALID_FRAME_CODE, "Malformed frame")
+    if type(data) is not dict:
+        INVALID_FRAMES.labels("malformed").inc()
+        raise FrameError(INVALID_FRAME_CODE, "Malformed frame")
+    return data
+
+
+def decode_authorization(raw: Union[str, bytes]) -> Authorization:
+    data = _parse(raw)
+    if data.get("type") != "authorization":
+        INVALID_FRAMES.labels("authorization").inc()
+        raise FrameError(INVALID_AUTHORIZATION_CODE, "Authorization expected")
+    # Токен возобновления из подсказки переподключения заменяет токен чата
+    token = data.get("token") or data.get("resume_token")
+    if type(token) is not str:
+        INVALID_FRAMES.labels("authorization").inc()
+        raise FrameError(MISSING_TOKEN_CODE, "Token required")
+    last_seq = data.get("last_seq")
+    if last_seq is not None and type(last_seq) is not int:
+        INVALID_FRAMES.labels("authorization").inc()
+        raise FrameError(INVALID_AUTHORIZATION_CODE, "Invalid last_seq")
+    return Authorization(token, last_seq)
+
+
+def decode_client_frame(raw: Union[str, bytes]) -> ClientFrame:
+    data = _parse(raw)
+    kind = data.get("type")
+    if kind == "pong":
+        return PONG
+    text = data.get("message")
+    if kind != "message" or type(text) is not str or not text or len(text) > MAX_MESSAGE_LENGTH:
+        INVALID_FRAMES.labels("message").inc()
+        raise FrameError(INVALID_FRAME_CODE, "Invalid message")
+    return ChatMessage(text)
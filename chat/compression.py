@@ -0,0 +1,69 @@
+# chat/compression.py
+import os
+import time
+
+from uvicorn.protocols.websockets.websockets_sansio_impl import WebSocketsSansIOProtocol
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import CONT, CTRL_OPCODES, Frame
+
+from metrics import DEFLATE_INPUT_BYTES, DEFLATE_OUTPUT_BYTES, DEFLATE_SECONDS, DEFLATE_SKIPPED
+
+# permessage-deflate: 0 - не предлагать сжатие клиентам
+WS_DEFLATE = os.getenv("WS_DEFLATE", "1") == "1"
+# Кадры короче порога (байт) уходят без сжатия: заголовок deflate съедает выигрыш
+WS_DEFLATE_THRESHOLD = int(os.getenv("WS_DEFLATE_THRESHOLD", "256"))
+# Без переноса контекста словарь не хранится между сообщениями: меньше памяти, хуже сжатие
+WS_DEFLATE_CONTEXT_TAKEOVER = os.getenv("WS_DEFLATE_CONTEXT_TAKEOVER", "1") == "1"
+# Окно (9-15) и memLevel (1-9) ограничивают память zlib на подключение
+WS_DEFLATE_WINDOW_BITS = int(os.getenv("WS_DEFLATE_WINDOW_BITS", "12"))
+WS_DEFLATE_MEM_LEVEL = int(os.getenv("WS_DEFLATE_MEM_LEVEL", "5"))
+WS_DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", "6"))
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """permessage-deflate, который не сжимает короткие сообщения и считает выигрыш и время"""
+
+    def encode(self, frame: Frame) -> Frame:
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        # Несжатое сообщение (RSV1 = 0) допустимо по RFC 7692 и не трогает словарь.
+        # Пропускаем только целые сообщения: продолжение фрагмента сжимается как начало
+        if frame.fin and frame.opcode is not CONT and len(frame.data) < WS_DEFLATE_THRESHOLD:
+            DEFLATE_SKIPPED.inc()
+            return frame
+        started = time.perf_counter()
+        encoded = super().encode(frame)
+        DEFLATE_SECONDS.inc(time.perf_counter() - started)
+        DEFLATE_INPUT_BYTES.inc(len(frame.data))
+        DEFLATE_OUTPUT_BYTES.inc(len(encoded.data))
+        return encoded
+
+
+class ThresholdDeflateFactory(ServerPerMessageDeflateFactory):
+    def process_request_params(self, params, accepted_extensions):
+        response, extension = super().process_request_params(params, accepted_extensions)
+        return response, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+        )
+
+
+def deflate_factory() -> ThresholdDeflateFactory:
+    return ThresholdDeflateFactory(
+        server_no_context_takeover=not WS_DEFLATE_CONTEXT_TAKEOVER,
+        client_no_context_takeover=not WS_DEFLATE_CONTEXT_TAKEOVER,
+        server_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+        client_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+        compress_settings={"level": WS_DEFLATE_LEVEL, "memLevel": WS_DEFLATE_MEM_LEVEL},
+    )
+
+
+class DeflateWebSocketProtocol(WebSocketsSansIOProtocol):
+    """Протокол uvicorn с настраиваемым permessage-deflate, запускается через protocol.ChatWebSocketProtocol"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.conn.available_extensions = [deflate_factory()] if WS_DEFLATE else []
@@ -0,0 +1,131 @@
+# chat/connections.py
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Размер очереди исходящих сообщений одного клиента
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "256"))
+# Максимальное отставание клиента (секунды), после которого он отключается
+SEND_MAX_LAG = float(os.getenv("SEND_MAX_LAG", "10"))
+# Сколько ждать закрытия сокета у зависшего клиента
+CLOSE_TIMEOUT = float(os.getenv("CLOSE_TIMEOUT", "5"))
+
+# Интервал пинга клиентов и время без входящих кадров, после которого подключение мертво (секунды)
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "25"))
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", "60"))
+
+# Код закрытия для медленных клиентов
+SLOW_CONSUMER_CODE = 4007
+# Код закрытия для клиентов, не ответивших на пинг
+HEARTBEAT_TIMEOUT_CODE = 4008
+
+_CLOSE = object()
+
+
+class Connection:
+    """Подключение клиента с ограниченной очередью исходящих сообщений и своей задачей-писателем"""
+
+    __slots__ = (
+        "websocket", "user_email", "room_name", "connected_at", "last_seen",
+        "messages_in", "frames_out", "queue", "writer", "closed", "closing",
+    )
+
+    def __init__(self, websocket: WebSocket, user_email: str, room_name: str):
+        self.websocket = websocket
+        self.user_email = user_email
+        self.room_name = room_name
+        self.connected_at = time.monotonic()
+        # Время последнего входящего кадра, по нему находятся мертвые подключения
+        self.last_seen = self.connected_at
+        # Счетчики входящих сообщений и поставленных в очередь кадров
+        self.messages_in = 0
+        self.frames_out = 0
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.writer: Optional[asyncio.Task] = None
+        # closed - новые сообщения не принимаются, closing - сокет уже закрывается
+        self.closed = False
+        self.closing = False
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def send(self, frame: str) -> bool:
+        """Ставит готовый кадр в очередь, не дожидаясь отправки. False - клиент отключен"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait((time.monotonic(), frame))
+        except asyncio.QueueFull:
+            logger.warning(f"Send queue overflow for {self.user_email}, disconnecting")
+            self.evict()
+            return False
+        self.frames_out += 1
+        return True
+
+    def close(self, code: int = 1000, reason: str = ""):
+        """Закрытие после отправки всего, что уже стоит в очереди"""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait((time.monotonic(), (_CLOSE, code, reason)))
+        except asyncio.QueueFull:
+            self.evict()
+            return
+        self.closed = True
+
+    def evict(self, code: int = SLOW_CONSUMER_CODE, reason: str = "Slow consumer"):
+        """Немедленное отключение без отправки оставшейся очереди"""
+        if self.closing:
+            return
+        self.closed = True
+        self.closing = True
+        if self.writer is not None and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        asyncio.create_task(self._close_socket(code, reason))
+
+    def stop(self):
+        """Остановка писателя после отключения клиента"""
+        self.closed = True
+        self.closing = True
+        if self.writer is not None:
+            self.writer.cancel()
+
+    async def wait_closed(self):
+        """Ожидание, пока писатель отправит очередь и закроет сокет"""
+        if self.writer is not None:
+            await asyncio.wait([self.writer], timeout=SEND_MAX_LAG + CLOSE_TIMEOUT)
+
+    async def _write_loop(self):
+        try:
+            while True:
+                enqueued_at, item = await self.queue.get()
+                if type(item) is tuple and item[0] is _CLOSE:
+                    self.closing = True
+                    await self._close_socket(item[1], item[2])
+                    return
+                remaining = SEND_MAX_LAG - (time.monotonic() - enqueued_at)
+                if remaining <= 0:
+                    logger.warning(f"Client {self.user_email} is lagging behind, disconnecting")
+                    self.evict()
+                    return
+                await asyncio.wait_for(self.websocket.send_text(item), remaining)
+        except asyncio.TimeoutError:
+            logger.warning(f"Send to {self.user_email} stalled, disconnecting")
+            self.evict()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending message: {e}")
+            self.closed = True
+
+    async def _close_socket(self, code: int, reason: str):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code, reason=reason), CLOSE_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error closing websocket: {e}")
@@ -0,0 +1,101 @@
+# chat/dispatch.py
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional
+
+from metrics import INBOUND_DROPPED
+
+logger = logging.getLogger(__name__)
+
+# Предел очереди входящих сообщений одной комнаты
+ROOM_INBOUND_QUEUE_SIZE = int(os.getenv("ROOM_INBOUND_QUEUE_SIZE", "1024"))
+
+
+class InboundMessage(NamedTuple):
+    """Сообщение участника, принятое циклом чтения и ожидающее рассылки"""
+    user_email: str
+    text: str
+
+
+# handle(room_name, message) - проверка комнаты, публикация и запись в историю
+Handler = Callable[[str, InboundMessage], Awaitable[None]]
+
+
+class RoomDispatcher:
+    """Очередь входящих сообщений комнаты и единственная задача, которая их рассылает"""
+
+    __slots__ = ("room_name", "queue", "task", "stopping")
+
+    def __init__(self, room_name: str):
+        self.room_name = room_name
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=ROOM_INBOUND_QUEUE_SIZE)
+        self.task: Optional[asyncio.Task] = None
+        # Комната опустела: задача завершится, когда разошлет уже принятое
+        self.stopping = False
+
+
+class Dispatchers:
+    """Диспетчеры активных комнат: циклы чтения только ставят сообщения в очередь,
+    порядок сообщений комнаты - порядок в ее очереди"""
+
+    def __init__(self, handle: Handler):
+        self.handle = handle
+        self.rooms: Dict[str, RoomDispatcher] = {}
+
+    def submit(self, room_name: str, message: InboundMessage) -> bool:
+        """Постановка сообщения в очередь комнаты. False - очередь переполнена"""
+        dispatcher = self.rooms.get(room_name)
+        if dispatcher is None:
+            dispatcher = self.rooms[room_name] = RoomDispatcher(room_name)
+            dispatcher.task = asyncio.create_task(self._run(dispatcher))
+        dispatcher.stopping = False
+        try:
+            dispatcher.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            INBOUND_DROPPED.inc()
+            return False
+        return True
+
+    def stop(self, room_name: str):
+        """Последний участник вышел: разослать принятое и завершиться"""
+        dispatcher = self.rooms.get(room_name)
+        if dispatcher is None:
+            return
+        dispatcher.stopping = True
+        # Будим ожидающую задачу; в полной очереди она и так увидит флаг
+        try:
+            dispatcher.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+    def cancel(self, room_name: str):
+        """Комната удалена: неразосланные сообщения больше не нужны"""
+        dispatcher = self.rooms.pop(room_name, None)
+        if dispatcher is not None:
+            dispatcher.task.cancel()
+
+    def close(self):
+        for room_name in list(self.rooms):
+            self.cancel(room_name)
+
+    async def _run(self, dispatcher: RoomDispatcher):
+        try:
+            while True:
+                message = await dispatcher.queue.get()
+                if message is not None:
+                    try:
+                        await self.handle(dispatcher.room_name, message)
+                    except Exception as e:
+                        logger.error(f"Error dispatching message in {dispatcher.room_name}: {e}")
+                if dispatcher.stopping and dispatcher.queue.empty():
+                    return
+        finally:
+            if self.rooms.get(dispatcher.room_name) is dispatcher:
+                del self.rooms[dispatcher.room_name]
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self.rooms),
+            "queued": sum(dispatcher.queue.qsize() for dispatcher in self.rooms.values()),
+        }
@@ -0,0 +1,76 @@
+# chat/drain.py
+import asyncio
+import logging
+import os
+import random
+import signal
+import threading
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# За сколько секунд закрываются все подключения при остановке. Вместе с ожиданием
+# писателей (CLOSE_TIMEOUT) должно быть меньше времени, которое оркестратор ждет до SIGKILL
+# (stop_grace_period в docker-compose.yml)
+DRAIN_PERIOD = float(os.getenv("DRAIN_PERIOD", "8"))
+# Шаг, с которым закрываются очередные подключения (секунды)
+DRAIN_STEP = float(os.getenv("DRAIN_STEP", "0.1"))
+# Диапазон задержки переподключения, которую сервер подсказывает клиенту (секунды)
+RECONNECT_MIN_DELAY = float(os.getenv("RECONNECT_MIN_DELAY", "1"))
+RECONNECT_MAX_DELAY = float(os.getenv("RECONNECT_MAX_DELAY", "5"))
+
+# Service Restart: клиент должен переподключиться
+DRAIN_CLOSE_CODE = 1012
+# Try Again Later: воркер останавливается и новых подключений не принимает
+DRAINING_REJECT_CODE = 1013
+
+
+class DrainState:
+    """Режим плавной остановки воркера"""
+
+    def __init__(self):
+        self.draining = False
+
+    @staticmethod
+    def reconnect_delay() -> float:
+        """Случайная задержка, чтобы клиенты не переподключались одновременно"""
+        return random.uniform(RECONNECT_MIN_DELAY, RECONNECT_MAX_DELAY)
+
+    @staticmethod
+    def schedule(total: int):
+        """Размеры групп подключений, закрываемых на каждом шаге за DRAIN_PERIOD"""
+        steps = max(1, int(DRAIN_PERIOD / DRAIN_STEP))
+        per_step = max(1, -(-total // steps))
+        for start in range(0, total, per_step):
+            yield start, min(start + per_step, total)
+
+    def install(self, drain: Callable[[], Awaitable[None]]):
+        """Перехват SIGTERM: сначала плавно отключаем клиентов, затем передаем сигнал
+        прежнему обработчику (uvicorn), который останавливает сервер"""
+        # Обработчик сигнала можно поставить только из главного потока
+        if threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+        previous = signal.getsignal(signal.SIGTERM)
+
+        async def run(signum):
+            try:
+                await drain()
+            except Exception as e:
+                logger.error(f"Error draining connections: {e}")
+            signal.signal(signal.SIGTERM, previous)
+            signal.raise_signal(signum)
+
+        def handler(signum, frame):
+            if self.draining:
+                # Повторный сигнал - останавливаемся сразу
+                signal.signal(signal.SIGTERM, previous)
+                signal.raise_signal(signum)
+                return
+            self.draining = True
+            loop.call_soon_threadsafe(loop.create_task, run(signum))
+
+        signal.signal(signal.SIGTERM, handler)
+
+
+drain_state = DrainState()
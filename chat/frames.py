@@ -0,0 +1,25 @@
+# chat/frames.py
+import json
+from typing import List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_frame(message: dict) -> str:
+    """Кодирует сообщение в текстовый кадр один раз для всех получателей"""
+    if orjson is not None:
+        return orjson.dumps(message).decode()
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+
+def with_seq(frame: str, seq: int) -> str:
+    """Добавляет номер последовательности в готовый кадр без повторного кодирования"""
+    return f'{{"seq":{seq},{frame[1:]}'
+
+
+def batch_frame(frames: List[str]) -> str:
+    """Склеивает готовые кадры в один кадр-массив без повторного кодирования"""
+    return f'[{",".join(frames)}]'
@@ -0,0 +1,96 @@
+# chat/history.py
+import os
+import sys
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+# Предел буфера одной комнаты: по числу кадров и по занимаемой памяти (байты)
+ROOM_HISTORY_SIZE = int(os.getenv("ROOM_HISTORY_SIZE", "200"))
+ROOM_HISTORY_MAX_BYTES = int(os.getenv("ROOM_HISTORY_MAX_BYTES", "262144"))
+# Сколько хранить буфер опустевшей комнаты, чтобы переподключившиеся могли догнать
+ROOM_HISTORY_IDLE_TTL = float(os.getenv("ROOM_HISTORY_IDLE_TTL", "300"))
+
+
+class RoomHistory:
+    """Кольцевой буфер последних кадров комнаты с номерами последовательности"""
+
+    __slots__ = ("frames", "size", "last_seq", "idle_since")
+
+    def __init__(self):
+        self.frames: Deque[Tuple[int, str]] = deque()
+        self.size = 0
+        self.last_seq = 0
+        self.idle_since: Optional[float] = None
+
+    def append(self, seq: int, frame: str):
+        # Пропуск в нумерации (кадры пришли не все) - старые кадры больше не годятся
+        if self.frames and seq != self.last_seq + 1:
+            self.frames.clear()
+            self.size = 0
+        self.frames.append((seq, frame))
+        self.size += sys.getsizeof(frame)
+        self.last_seq = seq
+        while len(self.frames) > ROOM_HISTORY_SIZE or self.size > ROOM_HISTORY_MAX_BYTES:
+            _, evicted = self.frames.popleft()
+            self.size -= sys.getsizeof(evicted)
+
+    def since(self, last_seq: int) -> Optional[List[str]]:
+        """Кадры после last_seq или None, если разрыв не восстановить из памяти"""
+        if last_seq == self.last_seq:
+            return []
+        if last_seq > self.last_seq or not self.frames or self.frames[0][0] > last_seq + 1:
+            return None
+        return [frame for seq, frame in self.frames if seq > last_seq]
+
+
+class HistoryStore:
+    """Буферы последних сообщений по комнатам этого воркера"""
+
+    def __init__(self):
+        self.rooms: Dict[str, RoomHistory] = {}
+
+    def get(self, room_name: str) -> Optional[RoomHistory]:
+        return self.rooms.get(room_name)
+
+    def activate(self, room_name: str) -> RoomHistory:
+        """В комнате есть участники: буфер нужен и не истекает"""
+        history = self.rooms.get(room_name)
+        if history is None:
+            history = self.rooms[room_name] = RoomHistory()
+        history.idle_since = None
+        return history
+
+    def deactivate(self, room_name: str):
+        """Комната опустела: буфер хранится еще ROOM_HISTORY_IDLE_TTL"""
+        history = self.rooms.get(room_name)
+        if history is not None:
+            history.idle_since = time.monotonic()
+
+    def drop(self, room_name: str):
+        self.rooms.pop(room_name, None)
+
+    def expire(self) -> List[str]:
+        """Удаляет буферы, простоявшие дольше ROOM_HISTORY_IDLE_TTL, возвращает их комнаты"""
+        deadline = time.monotonic() - ROOM_HISTORY_IDLE_TTL
+        expired = [
+            name for name, history in self.rooms.items()
+            if history.idle_since is not None and history.idle_since < deadline
+        ]
+        for name in expired:
+            del self.rooms[name]
+        return expired
+
+    def stats(self) -> dict:
+        sizes = [history.size for history in self.rooms.values()]
+        return {
+            "rooms": len(sizes),
+            "frames": sum(len(history.frames) for history in self.rooms.values()),
+            "bytes": sum(sizes),
+            "max_room_bytes": max(sizes, default=0),
+            "room_limit_frames": ROOM_HISTORY_SIZE,
+            "room_limit_bytes": ROOM_HISTORY_MAX_BYTES,
+        }
+
+
+room_history = HistoryStore()
@@ -0,0 +1,125 @@
+# chat/limits.py
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from metrics import RATE_LIMITED
+
+# Скорость (сообщений в секунду) и запас всплеска для каждого уровня, 0 - без ограничения
+RATE_LIMIT_CONNECTION = float(os.getenv("RATE_LIMIT_CONNECTION", "5"))
+RATE_LIMIT_CONNECTION_BURST = float(os.getenv("RATE_LIMIT_CONNECTION_BURST", "10"))
+RATE_LIMIT_USER = float(os.getenv("RATE_LIMIT_USER", "10"))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "20"))
+RATE_LIMIT_ROOM = float(os.getenv("RATE_LIMIT_ROOM", "200"))
+RATE_LIMIT_ROOM_BURST = float(os.getenv("RATE_LIMIT_ROOM_BURST", "400"))
+# Предел числа корзин пользователей и комнат в памяти воркера
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# notify - отклонять с системным сообщением, drop - молча отбрасывать
+RATE_LIMIT_ACTION = os.getenv("RATE_LIMIT_ACTION", "notify")
+# Не чаще одного системного сообщения о превышении на подключение за интервал (секунды)
+RATE_LIMIT_NOTICE_INTERVAL = float(os.getenv("RATE_LIMIT_NOTICE_INTERVAL", "1"))
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше burst"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def full(self, now: float) -> bool:
+        """Полная корзина ничем не отличается от новой, ее можно удалить"""
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class ConnectionLimit:
+    """Состояние ограничения одного подключения, живет вместе с ним"""
+
+    __slots__ = ("bucket", "notified_at")
+
+    def __init__(self, now: float):
+        self.bucket = (
+            TokenBucket(RATE_LIMIT_CONNECTION, RATE_LIMIT_CONNECTION_BURST, now)
+            if RATE_LIMIT_CONNECTION > 0 else None
+        )
+        self.notified_at = 0.0
+
+    def should_notify(self, now: float) -> bool:
+        if RATE_LIMIT_ACTION != "notify" or now - self.notified_at < RATE_LIMIT_NOTICE_INTERVAL:
+            return False
+        self.notified_at = now
+        return True
+
+
+class RateLimiter:
+    """Ограничение входящих сообщений по подключению, пользователю и комнате.
+    Сообщение проходит, только если токен есть во всех трех корзинах"""
+
+    def __init__(self):
+        # Порядок - от давно не использованных к недавним, вытеснение с начала
+        self.users: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.rooms: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def connection(self) -> ConnectionLimit:
+        return ConnectionLimit(time.monotonic())
+
+    def allow(self, limit: ConnectionLimit, room_name: str, user_email: str) -> Optional[str]:
+        """None - сообщение разрешено, иначе уровень, на котором сработало ограничение"""
+        now = time.monotonic()
+        buckets = []
+        for scope, bucket in (
+            ("connection", limit.bucket),
+            ("user", self._bucket(self.users, user_email, RATE_LIMIT_USER, RATE_LIMIT_USER_BURST, now)),
+            ("room", self._bucket(self.rooms, room_name, RATE_LIMIT_ROOM, RATE_LIMIT_ROOM_BURST, now)),
+        ):
+            if bucket is None:
+                continue
+            if bucket.refill(now) < 1:
+                RATE_LIMITED.labels(scope).inc()
+                return scope
+            buckets.append(bucket)
+        # Токены списываются, только если сообщение прошло все уровни
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return None
+
+    def _bucket(self, buckets: "OrderedDict[str, TokenBucket]", key: str, rate: float, burst: float, now: float):
+        if rate <= 0:
+            return None
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= RATE_LIMIT_MAX_KEYS:
+                # Дольше всех не использованная корзина, скорее всего, уже полна
+                buckets.popitem(last=False)
+            bucket = buckets[key] = TokenBucket(rate, burst, now)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def release_room(self, room_name: str):
+        """Комната опустела: ее корзина больше не нужна"""
+        self.rooms.pop(room_name, None)
+
+    def sweep(self):
+        """Удаление полных корзин пользователей и комнат"""
+        now = time.monotonic()
+        for buckets in (self.users, self.rooms):
+            full = [key for key, bucket in buckets.items() if bucket.full(now)]
+            for key in full:
+                del buckets[key]
+
+    def stats(self) -> dict:
+        return {"users": len(self.users), "rooms": len(self.rooms)}
+
+
+rate_limiter = RateLimiter()
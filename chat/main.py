@@ -1,181 +1,333 @@
 #chat/main.py
-import requests, json
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Query, Request
-from typing import Dict, List, Set
+import requests
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, Query, Request, Response
 import jwt
-from datetime import datetime
 import logging
-import httpx
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from clients import create_website_client
+from rooms import room_registry
+from connections import Connection, SEND_QUEUE_SIZE, CLOSE_TIMEOUT, HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, HEARTBEAT_TIMEOUT_CODE
+from frames import encode_frame, with_seq
+from backplane import backplane, RoomEvent, MESSAGE, CLOSE
+from persistence import message_writer
+from history import room_history
+from tokens import TokenCache
+from registry import connection_registry
+from drain import drain_state, DRAIN_CLOSE_CODE, DRAINING_REJECT_CODE, DRAIN_STEP
+from presence import presence_tracker
+from batching import RoomBatcher
+from limits import rate_limiter
+from dispatch import Dispatchers, InboundMessage
+from codec import FrameError, PONG, decode_authorization, decode_client_frame, receive_frame
+from admission import Admission, ADMISSION_REJECT_CODE, HANDSHAKE_TIMEOUT, HANDSHAKE_TIMEOUT_CODE
+from metrics import (
+    FANOUT_RECIPIENTS, FANOUT_SECONDS, HANDSHAKE_SECONDS, REAPED_CONNECTIONS, SEND_FAILURES,
+    metrics_response, room_joined, room_left,
+)
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Интервал пакетной перепроверки активных комнат (секунды)
+ROOM_REVALIDATE_INTERVAL = float(os.getenv("ROOM_REVALIDATE_INTERVAL", "30"))
+# Интервал очистки буферов истории опустевших комнат и полных корзин ограничений (секунды)
+HISTORY_SWEEP_INTERVAL = float(os.getenv("HISTORY_SWEEP_INTERVAL", "30"))
+# Максимум комнат в одном запросе числа участников
+OCCUPANCY_BATCH_LIMIT = int(os.getenv("OCCUPANCY_BATCH_LIMIT", "1000"))
+
+
+async def revalidate_active_rooms():
+    """Периодически перепроверяет все активные комнаты одним запросом"""
+    while True:
+        await asyncio.sleep(ROOM_REVALIDATE_INTERVAL)
+        if connection_registry.rooms:
+            await room_registry.revalidate(connection_registry.room_names())
+
+
+async def sweep_room_history():
+    """Периодически удаляет буферы истории давно опустевших комнат и ненужные корзины ограничений"""
+    while True:
+        await asyncio.sleep(HISTORY_SWEEP_INTERVAL)
+        for room_name in room_history.expire():
+            backplane.release_room(room_name)
+        rate_limiter.sweep()
+
+
+async def reap_idle_connections():
+    """Пингует клиентов и закрывает подключения, от которых давно не было кадров"""
+    ping_frame = encode_frame({"type": "ping"})
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        deadline = time.monotonic() - HEARTBEAT_TIMEOUT
+        dead = []
+        for connection in connection_registry.all():
+            if connection.last_seen < deadline:
+                dead.append(connection)
+            else:
+                connection.send(ping_frame)
+        for connection in dead:
+            remove_client(connection)
+            connection.evict(code=HEARTBEAT_TIMEOUT_CODE, reason="Heartbeat timeout")
+        if dead:
+            REAPED_CONNECTIONS.inc(len(dead))
+            logger.info(f"Reaped {len(dead)} dead connections")
+
+
+async def drain_connections():
+    """Плавная остановка: подключения закрываются группами за DRAIN_PERIOD,
+    каждый клиент получает случайную задержку переподключения и токен возобновления"""
+    connections = list(connection_registry.all())
+    random.shuffle(connections)
+    logger.info(f"Draining {len(connections)} connections")
+    for start, end in drain_state.schedule(len(connections)):
+        for connection in connections[start:end]:
+            room_name = connection.room_name
+            history = room_history.get(room_name)
+            remove_client(connection)
+            connection.send(encode_frame({
+                "type": "reconnect",
+                "delay": round(drain_state.reconnect_delay(), 3),
+                "resume_token": token_cache.resume_token(
+                    connection.user_email, room_name, history.last_seq if history else 0
+                )
+            }))
+            connection.close(code=DRAIN_CLOSE_CODE, reason="Service restart")
+        await asyncio.sleep(DRAIN_STEP)
+    # Даем писателям отправить последние кадры
+    writers = [connection.writer for connection in connections if connection.writer is not None]
+    if writers:
+        await asyncio.wait(writers, timeout=CLOSE_TIMEOUT)
+    await presence_tracker.flush()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    website_client = create_website_client()
+    app.state.website_client = website_client
+    room_registry.client = website_client
+    # Воркеру нужна комната, пока в ней есть участники или живой буфер истории
+    # Создание и удаление комнат на других воркерах сразу попадает в локальный реестр
+    await backplane.start(
+        deliver, lambda room_name: room_history.get(room_name) is not None, room_registry.set
+    )
+    message_writer.start(website_client)
+    presence_tracker.start()
+    # Прогреваем реестр комнат, чтобы первые подключения не ходили в website
+    await room_registry.warm()
+    revalidate_task = asyncio.create_task(revalidate_active_rooms())
+    sweep_task = asyncio.create_task(sweep_room_history())
+    reaper_task = asyncio.create_task(reap_idle_connections())
+    drain_state.install(drain_connections)
+    yield
+    revalidate_task.cancel()
+    sweep_task.cancel()
+    reaper_task.cancel()
+    dispatchers.close()
+    await message_writer.stop()
+    await presence_tracker.stop()
+    await backplane.stop()
+    await website_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Секретный ключ должен совпадать с ключом в website
 SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
+token_cache = TokenCache(SECRET_KEY, ALGORITHM)
 
-# Хранилище активных подключений: {room_name: [websocket]}
-connected_clients: Dict[str, List[WebSocket]] = {}
+def remove_client(connection: Connection):
+    """Удаление подключения из его комнаты, повторный вызов ничего не делает"""
+    room_name = connection.room_name
+    remaining = connection_registry.remove(connection)
+    if remaining is None:
+        return
+    room_left(room_name, remaining)
+    presence_tracker.leave(room_name, connection.user_email)
+    if not remaining:
+        # Буфер истории еще поживет для переподключений
+        room_history.deactivate(room_name)
+        rate_limiter.release_room(room_name)
+        dispatchers.stop(room_name)
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[int, list[WebSocket]] = {}
+def close_room_clients(room_name: str, frame: str, code: int = 1000, reason: str = "") -> int:
+    """Отправка последнего кадра и закрытие всех локальных подключений комнаты"""
+    # Накопленные сообщения уходят раньше кадра закрытия
+    batcher.flush(room_name)
+    clients = connection_registry.pop_room(room_name)
+    if clients:
+        room_left(room_name, 0)
+    presence_tracker.drop(room_name)
+    rate_limiter.release_room(room_name)
+    dispatchers.cancel(room_name)
+    for connection in clients:
+        connection.send(frame)
+        connection.close(code=code, reason=reason)
+    if room_history.get(room_name) is not None:
+        room_history.drop(room_name)
+        backplane.release_room(room_name)
+    return len(clients)
 
-    async def connect(self, websocket: WebSocket, room_id: int, user_email: str):  # Изменяем параметры
-        await websocket.accept()
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = []
-        self.active_connections[room_id].append(websocket)
-        # Убираем broadcast отсюда, так как он будет вызываться в websocket_endpoint
+def deliver(room_name: str, event: RoomEvent) -> int:
+    """Доставка события из backplane локальным участникам комнаты"""
+    if event.kind == CLOSE:
+        room_registry.invalidate(room_name)
+        return close_room_clients(room_name, event.frame, event.code, event.reason)
 
-    def disconnect(self, websocket: WebSocket, room_id: int):
-        if room_id in self.active_connections:
-            self.active_connections[room_id].remove(websocket)
-            if not self.active_connections[room_id]:
-                del self.active_connections[room_id]
+    # Буфер есть у каждой комнаты с локальными участниками
+    history = room_history.get(room_name)
+    if history is None:
+        return 0
+    seq = event.seq or history.last_seq + 1
+    frame = with_seq(event.frame, seq)
+    history.append(seq, frame)
 
-    async def broadcast(self, room_id: int, message: str):
-        if room_id in self.active_connections:
-            for connection in self.active_connections[room_id]:
-                await connection.send_text(message)
+    count = connection_registry.count(room_name)
+    if not count:
+        return 0
+    if batcher.enabled(room_name, count):
+        batcher.add(room_name, frame)
+        return count
+    return fan_out(room_name, frame)
 
-manager = ConnectionManager()
+def fan_out(room_name: str, frame: str) -> int:
+    """Постановка готового кадра в очереди всех локальных участников комнаты"""
+    clients = connection_registry.members(room_name)
+    count = len(clients)
+    if not count:
+        return 0
+    started = time.perf_counter()
+    # Медленные клиенты с переполненной очередью отключаются, остальные не ждут.
+    # Комнату нельзя менять во время обхода, поэтому они удаляются после него
+    failed = [client for client in clients if not client.send(frame)]
+    for client in failed:
+        SEND_FAILURES.inc()
+        remove_client(client)
+    FANOUT_SECONDS.observe(time.perf_counter() - started)
+    FANOUT_RECIPIENTS.observe(count)
+    return count
 
-async def verify_token(token: str, room_name: str) -> dict:
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        
-        # Проверяем срок действия токена
-        if payload.get("exp") and datetime.utcnow().timestamp() > payload["exp"]:
-            raise HTTPException(status_code=401, detail="Token expired")
-        
-        # Проверяем, что токен выдан для этой комнаты
-        if payload.get("chat_name") != room_name:
-            raise HTTPException(status_code=403, detail="Token is not valid for this chat")
-        
-        return payload
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+batcher = RoomBatcher(fan_out)
+admission = Admission(connection_registry)
 
-def cleanup_empty_rooms():
-    """Очистка пустых комнат"""
-    empty_rooms = [room for room, clients in connected_clients.items() if not clients]
-    for room in empty_rooms:
-        del connected_clients[room]
+async def publish_close(room_name: str, message: dict, code: int = 1000, reason: str = "") -> int:
+    """Закрытие комнаты на всех воркерах"""
+    room_registry.invalidate(room_name)
+    await backplane.publish_room_state(room_name, False)
+    await backplane.presence_clear(room_name)
+    return await backplane.publish(room_name, RoomEvent(CLOSE, encode_frame(message), code, reason))
 
 @app.post("/ws/{room_name}/close")
 async def close_room(room_name: str, request: Request):
+    room_registry.invalidate(room_name)
     try:
         data = await request.json()
-        if room_name in connected_clients:
-            close_message = json.dumps({
-                "type": "chat_deleted",
-                "message": data.get("message", "Чат был удален создателем")
-            })
-            print(f"Sending close message to {len(connected_clients[room_name])} clients") # Для отладки
-            
-            # Отправляем сообщение всем клиентам
-            for websocket in connected_clients[room_name]:
-                try:
-                    await websocket.send_text(close_message)
-                    print(f"Close message sent to client") # Для отладки
-                except Exception as e:
-                    print(f"Error sending close message: {e}") # Для отладки
-            
-            # Закрываем все соединения
-            for websocket in connected_clients[room_name]:
-                try:
-                    await websocket.close()
-                except Exception as e:
-                    print(f"Error closing websocket: {e}") # Для отладки
-            
-            # Очищаем список клиентов
-            connected_clients[room_name] = []
-            del connected_clients[room_name]
+        delivered = await publish_close(room_name, {
+            "type": "chat_deleted",
+            "message": data.get("message", "Чат был удален создателем")
+        })
+        logger.info(f"Close message for {room_name} delivered to {delivered} subscribers")
         
         return {"status": "success"}
     except Exception as e:
-        print(f"Error in close_room: {e}") # Для отладки
+        logger.error(f"Error in close_room: {e}")
         return {"status": "error", "message": str(e)}
 
-@app.post("/notify_delete/{room_name}")
-async def notify_delete(room_name: str):
-    """Уведомление о удалении комнаты"""
-    if room_name in connected_clients:
-        message = {
+async def apply_room_event(event: dict):
+    room_name = event["room"]
+    if event["type"] == "room_created":
+        # Все воркеры не ждут истечения отрицательной записи в кэше комнат
+        await backplane.publish_room_state(room_name, True)
+    elif event["type"] == "room_deleted":
+        await publish_close(room_name, {
             "type": "chat_deleted",
-            "message": "Чат был удален создателем"
-        }
-        
-        # Отправляем уведомление всем в комнате
-        for websocket in connected_clients[room_name][:]:
-            try:
-                await websocket.send_json(message)
-                await websocket.close(code=1000, reason="Chat deleted")
-            except:
-                pass
-        
-        # Удаляем комнату
-        del connected_clients[room_name]
-        
-        return {"status": "success"}
-    return {"status": "room not found"}
+            "message": event.get("payload", {}).get("message", "Чат был удален создателем")
+        }, reason="Chat deleted")
+    else:
+        logger.warning(f"Unknown room event type: {event['type']}")
+
+@app.post("/api/internal/room-events")
+async def room_events(request: Request):
+    """События комнат из outbox website пакетом, по порядку id.
+    Повторная доставка пакета безопасна на любом воркере: примененные id пропускаются"""
+    data = await request.json()
+    for event in data.get("events", []):
+        if await backplane.event_applied(event["id"]):
+            continue
+        # Ошибка прерывает пакет, website повторит его с этого события
+        await apply_room_event(event)
+        await backplane.mark_event_applied(event["id"])
+    return {"status": "success"}
 
 async def check_chat_exists(room_name: str) -> bool:
-    """Проверка существования чата через API website"""
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"http://website:8000/api/chat/{room_name}/exists")
-            if response.status_code == 200:
-                data = response.json()
-                return data.get("exists", False)
-            return False
-    except Exception as e:
-        logger.error(f"Error checking chat existence: {e}")
-        return False
+    """Проверка существования чата: локальный реестр, при промахе - API website"""
+    return await room_registry.exists(room_name)
 
 async def broadcast_message(room_name: str, message: dict):
-    """Отправка сообщения всем подключенным клиентам"""
-    if room_name not in connected_clients:
-        return
-        
+    """Отправка сообщения всем участникам комнаты на всех воркерах"""
     # Проверяем существование чата перед отправкой
     chat_exists = await check_chat_exists(room_name)
     if not chat_exists:
-        # Отправляем уведомление об удалении чата
-        for client in connected_clients[room_name][:]:
-            try:
-                await client.send_json({
-                    "type": "system",
-                    "message": "Чат был удален. Соединение закрывается."
-                })
-                await client.close(code=4005)
-            except Exception as e:
-                logger.error(f"Error closing connection: {e}")
-        
-        # Удаляем комнату
-        del connected_clients[room_name]
+        # Отправляем уведомление об удалении чата и закрываем подключения
+        await publish_close(room_name, {
+            "type": "system",
+            "message": "Чат был удален. Соединение закрывается."
+        }, code=4005)
         return
 
-    # Отправляем сообщение если чат существует
-    for client in connected_clients[room_name][:]:
-        try:
-            await client.send_json(message)
-        except Exception as e:
-            logger.error(f"Error sending message: {e}")
-            if client in connected_clients[room_name]:
-                connected_clients[room_name].remove(client)
+    # Кодируем один раз, всем получателям уходит один и тот же кадр
+    await backplane.publish(room_name, RoomEvent(MESSAGE, encode_frame(message)))
+
+async def dispatch_message(room_name: str, message: InboundMessage):
+    """Рассылка сообщения участника, вызывается только диспетчером комнаты"""
+    await broadcast_message(room_name, {
+        "type": "message",
+        "user": message.user_email,
+        "message": message.text
+    })
+    # Запись в историю идет в фоне пачками и не задерживает рассылку
+    message_writer.add(room_name, message.user_email, message.text)
+
+dispatchers = Dispatchers(dispatch_message)
+
+async def reject_handshake(websocket: WebSocket, reason: str):
+    """Отказ до accept: 503 с Retry-After, если сервер умеет отвечать на рукопожатие HTTP-ответом"""
+    if "websocket.http.response" in websocket.scope.get("extensions", {}):
+        await websocket.send_denial_response(Response(
+            f"Too many connections: {reason}",
+            status_code=503,
+            headers={"Retry-After": str(admission.retry_after())},
+        ))
+    else:
+        await websocket.close(code=ADMISSION_REJECT_CODE)
 
 @app.websocket("/ws/{room_name}")
 async def websocket_endpoint(
     websocket: WebSocket,
     room_name: str
 ):
-    await websocket.accept()
+    # Останавливающийся воркер новых подключений не принимает
+    if drain_state.draining:
+        await websocket.close(code=DRAINING_REJECT_CODE)
+        return
+
+    # Перегруженный воркер отказывает до accept и запроса к website
+    reason = admission.check(room_name)
+    if reason is not None:
+        await reject_handshake(websocket, reason)
+        return
+
+    handshake = admission.handshake()
     user_email = None
+    connection = None
     
     try:
+        await websocket.accept()
+        accepted_at = time.perf_counter()
+
         # Проверяем существование чата при подключении
         if not await check_chat_exists(room_name):
             await websocket.send_json({
@@ -186,19 +338,20 @@ async def websocket_endpoint(
             return
 
         # Ждем сообщение с авторизацией
-        auth_data = await websocket.receive_json()
-        if auth_data.get('type') != 'authorization':
-            await websocket.close(code=4000)
+        try:
+            auth = decode_authorization(
+                await asyncio.wait_for(receive_frame(websocket), HANDSHAKE_TIMEOUT)
+            )
+        except FrameError as e:
+            await websocket.close(code=e.code, reason=e.reason)
             return
-            
-        token = auth_data.get('token')
-        if not token:
-            await websocket.close(code=4001)
+        except asyncio.TimeoutError:
+            await websocket.close(code=HANDSHAKE_TIMEOUT_CODE, reason="Authorization timeout")
             return
 
         # Проверяем токен
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            payload = token_cache.decode(auth.token)
             if payload['chat_name'] != room_name:
                 await websocket.close(code=4002)
                 return
@@ -208,72 +361,144 @@ async def websocket_endpoint(
             await websocket.close(code=4003)
             return
 
-        # Добавляем в комнату
-        if room_name not in connected_clients:
-            connected_clients[room_name] = []
-        connected_clients[room_name].append(websocket)
+        # Пределы комнаты и пользователя - до подписки на комнату
+        reason = admission.check_member(room_name, user_email)
+        if reason is not None:
+            await websocket.send_text(encode_frame({"type": "reconnect", "delay": admission.retry_after()}))
+            await websocket.close(code=ADMISSION_REJECT_CODE, reason="Too many connections")
+            return
 
-        # Отправляем уведомление о подключении нового пользователя
-        await broadcast_message(room_name, {
-            "type": "system",
-            "message": f"Пользователь {user_email} присоединился к чату"
-        })
+        # Номер последнего полученного сообщения для докачки пропущенного
+        last_seq = auth.last_seq
+        if last_seq is None and payload.get('type') == 'resume':
+            last_seq = payload.get('seq')
+
+        # Буфер истории создается до подписки, чтобы не пропустить сообщения
+        room_history.activate(room_name)
+        await backplane.acquire_room(room_name)
+
+        # Добавляем в комнату, дальше все отправки идут через очередь подключения
+        connection = Connection(websocket, user_email, room_name)
+        connection.start()
+        history = room_history.activate(room_name)
+        # Накопленное уже есть в буфере истории: отправляем до входа, чтобы не продублировать
+        batcher.flush(room_name)
+        connection_registry.add(connection)
+        room_joined(room_name)
+        presence_tracker.join(room_name, user_email)
+
+        # Досылаем пропущенное из памяти до любых новых сообщений
+        if last_seq is not None:
+            missed = history.since(last_seq)
+            if missed is None or len(missed) >= SEND_QUEUE_SIZE:
+                connection.send(encode_frame({"type": "resync"}))
+            else:
+                for frame in missed:
+                    connection.send(frame)
+        # Состав комнаты один раз после догоняющих кадров, дальше только дельты.
+        # О самом входе остальные узнают из общей дельты за окно
+        connection.send(encode_frame(await presence_tracker.snapshot(room_name)))
+        HANDSHAKE_SECONDS.observe(time.perf_counter() - accepted_at)
+        handshake.done()
 
         # Основной цикл чата
+        limit = rate_limiter.connection()
         try:
             while True:
-                data = await websocket.receive_json()
-                # Проверяем существование чата перед отправкой каждого сообщения
-                if not await check_chat_exists(room_name):
-                    await websocket.send_json({
-                        "type": "system",
-                        "message": "Чат был удален. Соединение закрывается."
-                    })
-                    await websocket.close(code=4005)
+                # Размер и формат кадра проверяются до разбора и рассылки
+                try:
+                    frame = decode_client_frame(await receive_frame(websocket))
+                except FrameError as e:
+                    remove_client(connection)
+                    connection.close(code=e.code, reason=e.reason)
+                    await connection.wait_closed()
                     return
-
-                await broadcast_message(room_name, {
-                    "type": "message",
-                    "user": user_email,
-                    "message": data["message"]
-                })
+                connection.last_seen = time.monotonic()
+                # Ответ на пинг только отмечает, что клиент жив
+                if frame is PONG:
+                    continue
+                connection.messages_in += 1
+                # Превышение лимита отклоняется до проверки комнаты и рассылки
+                if rate_limiter.allow(limit, room_name, user_email) is not None:
+                    if limit.should_notify(time.monotonic()):
+                        connection.send(encode_frame({
+                            "type": "system",
+                            "message": "Слишком много сообщений, подождите немного"
+                        }))
+                    continue
+                # Цикл чтения только ставит сообщение в очередь комнаты. Существование
+                # чата проверяет диспетчер, он же закрывает комнату, если чат удален
+                if not dispatchers.submit(room_name, InboundMessage(user_email, frame.text)):
+                    connection.send(encode_frame({
+                        "type": "system",
+                        "message": "Комната перегружена, сообщение не отправлено"
+                    }))
         except WebSocketDisconnect:
-            # Отправляем уведомление об отключении пользователя
-            if room_name in connected_clients:
-                connected_clients[room_name].remove(websocket)
-                await broadcast_message(room_name, {
-                    "type": "system",
-                    "message": f"Пользователь {user_email} покинул чат"
-                })
-                if not connected_clients[room_name]:
-                    del connected_clients[room_name]
+            # Выход попадет в дельту состава комнаты
+            remove_client(connection)
     except Exception as e:
         logger.error(f"Error in websocket connection: {e}")
-        if user_email and room_name in connected_clients:
-            connected_clients[room_name].remove(websocket)
-            await broadcast_message(room_name, {
-                "type": "system",
-                "message": f"Пользователь {user_email} отключился из-за ошибки"
-            })
-        await websocket.close(code=4004)
+        if connection:
+            connection.stop()
+            remove_client(connection)
+        try:
+            await websocket.close(code=4004)
+        except Exception:
+            pass
+    finally:
+        handshake.done()
+        if connection:
+            connection.stop()
 
 @app.post("/ws/{room_name}/broadcast")
-async def broadcast_message(room_name: str, message: dict):
-    if room_name in connected_clients:
-        # Отправляем сообщение всем подключенным клиентам
-        for websocket in connected_clients[room_name][:]:  # Создаем копию списка
-            try:
-                await websocket.send_json(message)
-                if message.get("type") == "chat_deleted":
-                    await websocket.close(code=1000, reason="Chat deleted")
-            except Exception as e:
-                print(f"Error broadcasting message: {e}")
-        
-        # Если это сообщение об удалении, очищаем список клиентов
-        if message.get("type") == "chat_deleted":
-            connected_clients[room_name] = []
-            if room_name in connected_clients:
-                del connected_clients[room_name]
-        
+async def broadcast_endpoint(room_name: str, message: dict):
+    # Если это сообщение об удалении, закрываем все подключения комнаты
+    if message.get("type") == "chat_deleted":
+        delivered = await publish_close(room_name, message, reason="Chat deleted")
+    else:
+        delivered = await backplane.publish(room_name, RoomEvent(MESSAGE, encode_frame(message)))
+    if delivered:
         return {"status": "success"}
-    return {"status": "room not found"}
\ No newline at end of file
+    return {"status": "room not found"}
+
+@app.post("/rooms/occupancy")
+async def rooms_occupancy(request: Request):
+    """Число участников в комнатах для списка чатов в website: {"names": [...]}"""
+    data = await request.json()
+    names = data.get("names", [])[:OCCUPANCY_BATCH_LIMIT]
+    return {"occupancy": await presence_tracker.occupancy(names)}
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики в формате Prometheus"""
+    return metrics_response()
+
+@app.get("/stats/history")
+async def history_stats():
+    """Память, занятая буферами последних сообщений"""
+    return room_history.stats()
+
+@app.get("/stats/connections")
+async def connection_stats():
+    """Число комнат, пользователей и подключений этого воркера"""
+    return connection_registry.stats()
+
+@app.get("/stats/dispatch")
+async def dispatch_stats():
+    """Активные диспетчеры комнат и длина их очередей"""
+    return dispatchers.stats()
+
+@app.get("/stats/limits")
+async def limit_stats():
+    """Число корзин ограничений частоты сообщений в памяти"""
+    return rate_limiter.stats()
+
+@app.get("/stats/admission")
+async def admission_stats():
+    """Входы в процессе и число подключений относительно пределов допуска"""
+    return admission.stats()
+
+@app.get("/stats/tokens")
+async def token_stats():
+    """Попадания в кэш проверенных токенов"""
+    return token_cache.stats()
@@ -0,0 +1,78 @@
+# chat/metrics.py
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Границы гистограмм в секундах: горячий путь укладывается в доли миллисекунды,
+# запросы к website - в десятки миллисекунд
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+REQUEST_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+ROOM_CONNECTIONS = Gauge(
+    "chat_room_connections", "Active WebSocket connections per room on this worker", ["room"]
+)
+HANDSHAKE_SECONDS = Histogram(
+    "chat_handshake_seconds", "Time from accept to joining the room", buckets=REQUEST_BUCKETS
+)
+FANOUT_SECONDS = Histogram(
+    "chat_fanout_seconds", "Time to enqueue one message for all local room members", buckets=FAST_BUCKETS
+)
+FANOUT_RECIPIENTS = Histogram(
+    "chat_fanout_recipients", "Local recipients per delivered message",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+BATCH_FRAMES = Histogram(
+    "chat_batch_frames", "Messages per outbound batch in rooms with batching enabled",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+SEND_FAILURES = Counter(
+    "chat_send_failures_total", "Connections evicted because their send queue overflowed"
+)
+REAPED_CONNECTIONS = Counter(
+    "chat_reaped_connections_total", "Connections closed after missing heartbeats"
+)
+INVALID_FRAMES = Counter(
+    "chat_invalid_frames_total", "Inbound frames rejected by the codec", ["reason"]
+)
+INBOUND_DROPPED = Counter(
+    "chat_inbound_dropped_total", "Inbound messages dropped because the room queue was full"
+)
+RATE_LIMITED = Counter(
+    "chat_rate_limited_total", "Inbound messages rejected by rate limits", ["scope"]
+)
+DEFLATE_INPUT_BYTES = Counter(
+    "chat_deflate_input_bytes_total", "Outbound payload bytes passed to permessage-deflate"
+)
+DEFLATE_OUTPUT_BYTES = Counter(
+    "chat_deflate_output_bytes_total", "Outbound payload bytes after permessage-deflate"
+)
+DEFLATE_SECONDS = Counter(
+    "chat_deflate_seconds_total", "CPU time spent compressing outbound frames"
+)
+DEFLATE_SKIPPED = Counter(
+    "chat_deflate_skipped_frames_total", "Outbound frames sent uncompressed because they are below the threshold"
+)
+ADMISSION_REJECTED = Counter(
+    "chat_admission_rejected_total", "WebSocket connections rejected by admission limits", ["reason"]
+)
+ROOM_CHECK_SECONDS = Histogram(
+    "chat_room_check_seconds", "Room existence requests to website", ["kind"], buckets=REQUEST_BUCKETS
+)
+
+
+def room_joined(room_name: str):
+    ROOM_CONNECTIONS.labels(room_name).inc()
+
+
+def room_left(room_name: str, remaining: int):
+    """Серия пустой комнаты удаляется, чтобы число меток не росло бесконечно"""
+    if remaining:
+        ROOM_CONNECTIONS.labels(room_name).dec()
+    else:
+        try:
+            ROOM_CONNECTIONS.remove(room_name)
+        except KeyError:
+            pass
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,93 @@
+# chat/persistence.py
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Сброс буфера при достижении размера пачки или по истечении интервала (секунды)
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "200"))
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "0.5"))
+# Предел буфера на случай недоступности website, лишние сообщения теряются
+MESSAGE_BUFFER_LIMIT = int(os.getenv("MESSAGE_BUFFER_LIMIT", "10000"))
+
+
+class MessageWriter:
+    """Отложенная запись сообщений: буфер сбрасывается в website пачками по размеру или по времени"""
+
+    def __init__(self):
+        self.buffer: Deque[dict] = deque()
+        self.client: Optional[httpx.AsyncClient] = None
+        self.dropped = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, client: httpx.AsyncClient):
+        self.client = client
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Пачка, прерванная остановкой, уже вернулась в буфер
+        await self.flush()
+
+    def add(self, room_name: str, user_email: str, text: str):
+        """Постановка сообщения в буфер, без ожидания записи"""
+        if len(self.buffer) >= MESSAGE_BUFFER_LIMIT:
+            self.buffer.popleft()
+            self.dropped += 1
+        self.buffer.append({
+            "room": room_name,
+            "user": user_email,
+            "message": text,
+            "created_at": time.time()
+        })
+        if len(self.buffer) >= MESSAGE_BATCH_SIZE and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), MESSAGE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        while self.buffer:
+            count = min(len(self.buffer), MESSAGE_BATCH_SIZE)
+            batch = [self.buffer.popleft() for _ in range(count)]
+            try:
+                response = await self.client.post("/api/internal/messages", json={"messages": batch})
+                response.raise_for_status()
+            except asyncio.CancelledError:
+                self._requeue(batch)
+                raise
+            except Exception as e:
+                logger.error(f"Error storing {len(batch)} messages: {e}")
+                self._requeue(batch)
+                return
+
+    def _requeue(self, batch: list):
+        """Возврат пачки в начало буфера, повторим на следующем сбросе"""
+        free = MESSAGE_BUFFER_LIMIT - len(self.buffer)
+        if free < len(batch):
+            self.dropped += len(batch) - max(free, 0)
+            batch = batch[len(batch) - max(free, 0):]
+        self.buffer.extendleft(reversed(batch))
+
+
+message_writer = MessageWriter()
@@ -0,0 +1,113 @@
+# chat/presence.py
+import asyncio
+import logging
+import os
+from typing import Dict, Optional
+
+from backplane import backplane, RoomEvent, MESSAGE
+from frames import encode_frame
+
+logger = logging.getLogger(__name__)
+
+# Окно, за которое входы и выходы комнаты собираются в одну дельту (секунды)
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "1.0"))
+
+
+class PresenceTracker:
+    """Состав комнат: изменения копятся за окно и рассылаются одной дельтой на комнату
+    вместо системного сообщения на каждый вход и выход"""
+
+    def __init__(self):
+        # {room_name: {email: изменение числа подключений этого воркера}}
+        self.pending: Dict[str, Dict[str, int]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Изменения, прерванные остановкой, уже вернулись в pending
+        await self.flush()
+
+    def join(self, room_name: str, user_email: str):
+        self._change(room_name, user_email, 1)
+
+    def leave(self, room_name: str, user_email: str):
+        self._change(room_name, user_email, -1)
+
+    def _change(self, room_name: str, user_email: str, delta: int):
+        changes = self.pending.setdefault(room_name, {})
+        # Вход и выход внутри одного окна взаимно сокращаются
+        delta += changes.get(user_email, 0)
+        if delta:
+            changes[user_email] = delta
+        else:
+            del changes[user_email]
+            if not changes:
+                del self.pending[room_name]
+
+    def _restore(self, room_name: str, changes: Dict[str, int]):
+        """Возврат непримененных изменений, применим на следующем окне"""
+        for user_email, delta in changes.items():
+            self._change(room_name, user_email, delta)
+
+    def drop(self, room_name: str):
+        """Комната закрыта: ее несостоявшиеся изменения больше не нужны"""
+        self.pending.pop(room_name, None)
+
+    async def snapshot(self, room_name: str) -> dict:
+        """Текущий состав комнаты для только что вошедшего, с учетом еще не разосланных входов"""
+        members = set(await backplane.presence_members(room_name))
+        for user_email, delta in self.pending.get(room_name, {}).items():
+            if delta > 0:
+                members.add(user_email)
+        return {"type": "presence_snapshot", "members": sorted(members), "count": len(members)}
+
+    async def occupancy(self, room_names) -> Dict[str, int]:
+        return await backplane.presence_counts(room_names)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(PRESENCE_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        try:
+            while pending:
+                room_name = next(iter(pending))
+                changes = pending[room_name]
+                try:
+                    joined, left, count = await backplane.presence_update(room_name, changes)
+                except Exception as e:
+                    logger.error(f"Error updating presence for {room_name}: {e}")
+                    self._restore(room_name, changes)
+                    del pending[room_name]
+                    continue
+                del pending[room_name]
+                if not joined and not left:
+                    continue
+                try:
+                    await backplane.publish(room_name, RoomEvent(MESSAGE, encode_frame({
+                        "type": "presence",
+                        "joined": joined,
+                        "left": left,
+                        "count": count
+                    })))
+                except Exception as e:
+                    logger.error(f"Error publishing presence for {room_name}: {e}")
+        except asyncio.CancelledError:
+            # Остановка посреди сброса: неразосланные комнаты применятся при следующем
+            for room_name, changes in pending.items():
+                self._restore(room_name, changes)
+            raise
+
+
+presence_tracker = PresenceTracker()
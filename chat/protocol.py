@@ -0,0 +1,7 @@
+# chat/protocol.py
+from admission import DenialResponseMixin
+from compression import DeflateWebSocketProtocol
+
+
+class ChatWebSocketProtocol(DenialResponseMixin, DeflateWebSocketProtocol):
+    """Протокол WebSocket сервиса: uvicorn --ws protocol:ChatWebSocketProtocol"""
@@ -0,0 +1,94 @@
+# chat/registry.py
+from typing import Dict, Iterator, KeysView, List, Optional, Set
+
+from connections import Connection
+
+
+class ConnectionRegistry:
+    """Подключения этого воркера по комнатам и по пользователям.
+    Добавление и удаление за O(1), рассылка идет по участникам без копирования"""
+
+    def __init__(self):
+        # {room_name: {Connection: None}} - словарь как упорядоченное множество
+        self.rooms: Dict[str, Dict[Connection, None]] = {}
+        # {user_email: {Connection}} - все вкладки пользователя на этом воркере
+        self.users: Dict[str, Set[Connection]] = {}
+        # Всего подключений - для допуска новых без обхода комнат
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, room_name: str) -> bool:
+        return room_name in self.rooms
+
+    def add(self, connection: Connection) -> int:
+        """Добавляет подключение, возвращает число участников комнаты"""
+        members = self.rooms.get(connection.room_name)
+        if members is None:
+            members = self.rooms[connection.room_name] = {}
+        if connection not in members:
+            members[connection] = None
+            self.size += 1
+        self.users.setdefault(connection.user_email, set()).add(connection)
+        return len(members)
+
+    def remove(self, connection: Connection) -> Optional[int]:
+        """Удаляет подключение, возвращает оставшееся число участников комнаты
+        или None, если подключения уже нет"""
+        members = self.rooms.get(connection.room_name)
+        if members is None or connection not in members:
+            return None
+        del members[connection]
+        self.size -= 1
+        if not members:
+            del self.rooms[connection.room_name]
+        self._unindex(connection)
+        return len(members)
+
+    def pop_room(self, room_name: str) -> List[Connection]:
+        """Убирает комнату целиком, возвращает ее подключения"""
+        members = self.rooms.pop(room_name, None)
+        if not members:
+            return []
+        self.size -= len(members)
+        for connection in members:
+            self._unindex(connection)
+        return list(members)
+
+    def _unindex(self, connection: Connection):
+        tabs = self.users.get(connection.user_email)
+        if tabs is not None:
+            tabs.discard(connection)
+            if not tabs:
+                del self.users[connection.user_email]
+
+    def members(self, room_name: str) -> KeysView:
+        """Участники комнаты без копирования; во время обхода комнату не изменять"""
+        members = self.rooms.get(room_name)
+        return members.keys() if members is not None else {}.keys()
+
+    def count(self, room_name: str) -> int:
+        members = self.rooms.get(room_name)
+        return len(members) if members is not None else 0
+
+    def user(self, user_email: str) -> Set[Connection]:
+        """Все подключения пользователя на этом воркере, в любых комнатах"""
+        return self.users.get(user_email, set())
+
+    def room_names(self) -> List[str]:
+        return list(self.rooms)
+
+    def all(self) -> Iterator[Connection]:
+        for members in self.rooms.values():
+            yield from members
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self.rooms),
+            "users": len(self.users),
+            "connections": len(self),
+        }
+
+
+connection_registry = ConnectionRegistry()
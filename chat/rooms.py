@@ -0,0 +1,138 @@
+# chat/rooms.py
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import httpx
+
+from metrics import ROOM_CHECK_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Время жизни положительной и отрицательной записи в кэше (секунды)
+ROOM_CACHE_TTL = float(os.getenv("ROOM_CACHE_TTL", "60"))
+ROOM_CACHE_NEGATIVE_TTL = float(os.getenv("ROOM_CACHE_NEGATIVE_TTL", "5"))
+ROOM_CACHE_MAX_SIZE = int(os.getenv("ROOM_CACHE_MAX_SIZE", "100000"))
+# Максимум комнат в одном пакетном запросе к website
+ROOM_BATCH_SIZE = int(os.getenv("ROOM_BATCH_SIZE", "500"))
+# Размер страницы имен комнат при прогреве
+ROOM_WARM_PAGE_SIZE = int(os.getenv("ROOM_WARM_PAGE_SIZE", "1000"))
+
+
+class RoomRegistry:
+    """Локальный реестр существования комнат с TTL и негативным кэшированием"""
+
+    def __init__(
+        self,
+        ttl: float = ROOM_CACHE_TTL,
+        negative_ttl: float = ROOM_CACHE_NEGATIVE_TTL,
+        max_size: int = ROOM_CACHE_MAX_SIZE,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        # {room_name: (exists, expires_at)}, от давно использованных к недавним
+        self._entries: "OrderedDict[str, Tuple[bool, float]]" = OrderedDict()
+        # Запросы к website, которые уже выполняются, чтобы не дублировать их
+        self._pending: Dict[str, asyncio.Task] = {}
+        # Общий клиент к website, привязывается в lifespan приложения
+        self.client: Optional[httpx.AsyncClient] = None
+
+    def get(self, room_name: str) -> Optional[bool]:
+        """Значение из кэша или None, если записи нет или она устарела"""
+        entry = self._entries.get(room_name)
+        if entry is None:
+            return None
+        exists, expires_at = entry
+        if expires_at < time.monotonic():
+            return None
+        self._entries.move_to_end(room_name)
+        return exists
+
+    def set(self, room_name: str, exists: bool):
+        if room_name in self._entries:
+            self._entries.move_to_end(room_name)
+        elif len(self._entries) >= self.max_size:
+            # Вытесняется дольше всех не использованная запись
+            self._entries.popitem(last=False)
+        ttl = self.ttl if exists else self.negative_ttl
+        self._entries[room_name] = (exists, time.monotonic() + ttl)
+
+    def invalidate(self, room_name: str):
+        """Комната удалена: сразу запоминаем отрицательный ответ"""
+        self.set(room_name, False)
+
+    async def exists(self, room_name: str) -> bool:
+        """Проверка существования комнаты: сначала кэш, затем website"""
+        cached = self.get(room_name)
+        if cached is not None:
+            return cached
+
+        pending = self._pending.get(room_name)
+        if pending is None:
+            # Запрос - отдельная задача: отмена одного из ожидающих не отменяет его для остальных
+            pending = asyncio.create_task(self._fetch(room_name))
+            self._pending[room_name] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(room_name, None))
+        return await asyncio.shield(pending)
+
+    async def _fetch(self, room_name: str) -> bool:
+        try:
+            with ROOM_CHECK_SECONDS.labels("single").time():
+                response = await self.client.get(f"/api/chat/{room_name}/exists")
+            if response.status_code == 200:
+                exists = response.json().get("exists", False)
+                self.set(room_name, exists)
+                return exists
+            return self._stale(room_name)
+        except Exception as e:
+            logger.error(f"Error checking chat existence: {e}")
+            return self._stale(room_name)
+
+    def _stale(self, room_name: str) -> bool:
+        """Если website недоступен, используем устаревшую запись, если она есть"""
+        entry = self._entries.get(room_name)
+        return entry[0] if entry else False
+
+    async def warm(self):
+        """Начальное заполнение реестра комнатами из website, постранично и не больше max_size:
+        сверх предела каждая вставка вызывала бы вытеснение"""
+        after_id = None
+        try:
+            while len(self._entries) < self.max_size:
+                params = {"limit": min(ROOM_WARM_PAGE_SIZE, self.max_size - len(self._entries))}
+                if after_id is not None:
+                    params["after_id"] = after_id
+                response = await self.client.get("/api/internal/chats/names", params=params)
+                response.raise_for_status()
+                page = response.json()
+                for name in page.get("names", []):
+                    self.set(name, True)
+                after_id = page.get("next_after_id")
+                if after_id is None:
+                    break
+        except Exception as e:
+            logger.error(f"Error warming room registry: {e}")
+        logger.info(f"Room registry warmed with {len(self._entries)} rooms")
+
+    async def revalidate(self, room_names: Iterable[str]):
+        """Пакетная перепроверка комнат одним запросом на каждые ROOM_BATCH_SIZE имен"""
+        names = list(room_names)
+        for start in range(0, len(names), ROOM_BATCH_SIZE):
+            batch = names[start:start + ROOM_BATCH_SIZE]
+            try:
+                with ROOM_CHECK_SECONDS.labels("batch").time():
+                    response = await self.client.post("/api/chats/exists", json={"names": batch})
+                response.raise_for_status()
+                result = response.json().get("exists", {})
+            except Exception as e:
+                logger.error(f"Error revalidating rooms: {e}")
+                return
+            for name in batch:
+                self.set(name, bool(result.get(name, False)))
+
+
+room_registry = RoomRegistry()
@@ -0,0 +1,84 @@
+# chat/tokens.py
+import hashlib
+import heapq
+import os
+import time
+from typing import Dict, List, Tuple
+
+import jwt
+
+# Предел числа проверенных токенов в кэше
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "50000"))
+# Срок действия токена возобновления, выдаваемого при плавной остановке (секунды)
+RESUME_TOKEN_TTL = int(os.getenv("RESUME_TOKEN_TTL", "300"))
+
+
+class TokenCache:
+    """Кэш проверенных токенов чата: переподключение с тем же токеном обходится без jwt.decode.
+    Ключ - хэш токена, запись живет до exp из claims"""
+
+    def __init__(self, secret_key: str, algorithm: str, maxsize: int = TOKEN_CACHE_SIZE):
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+        self.maxsize = maxsize
+        # {digest: (payload, exp)}
+        self._entries: Dict[bytes, Tuple[dict, float]] = {}
+        # Куча (exp, digest) для вытеснения без обхода записей; элементы удаленных
+        # и перезаписанных ключей пропускаются при извлечении
+        self._expiry: List[Tuple[float, bytes]] = []
+        self.hits = 0
+        self.misses = 0
+
+    def decode(self, token: str) -> dict:
+        """Claims токена; jwt.InvalidTokenError, если токен неверен или истек"""
+        key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        entry = self._entries.get(key)
+        if entry is not None:
+            payload, exp = entry
+            if exp > time.time():
+                self.hits += 1
+                return payload
+            del self._entries[key]
+
+        self.misses += 1
+        payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+        # Кэшируем только токены с ограниченным сроком действия
+        exp = payload.get("exp")
+        if exp is not None:
+            if len(self._entries) >= self.maxsize:
+                self._evict()
+            self._entries[key] = (payload, exp)
+            self._push(exp, key)
+        return payload
+
+    def resume_token(self, user_email: str, room_name: str, seq: int) -> str:
+        """Короткоживущий токен для переподключения к той же комнате без запроса к website"""
+        return jwt.encode(
+            {
+                "type": "resume",
+                "email": user_email,
+                "chat_name": room_name,
+                "seq": seq,
+                "exp": int(time.time()) + RESUME_TOKEN_TTL,
+            },
+            self.secret_key,
+            algorithm=self.algorithm,
+        )
+
+    def _push(self, exp: float, key: bytes):
+        heapq.heappush(self._expiry, (exp, key))
+        # Устаревших элементов в куче не больше, чем живых: перестройка за O(n) раз на n вставок
+        if len(self._expiry) > 2 * len(self._entries) + 64:
+            self._expiry = [(exp, key) for key, (_, exp) in self._entries.items()]
+            heapq.heapify(self._expiry)
+
+    def _evict(self):
+        """Освобождает место за счет записи, которая истекает раньше всех (истекшие - первыми)"""
+        while len(self._entries) >= self.maxsize and self._expiry:
+            exp, key = heapq.heappop(self._expiry)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == exp:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
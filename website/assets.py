@@ -0,0 +1,136 @@
+# website/assets.py
+import gzip
+import hashlib
+import mimetypes
+from pathlib import Path
+from typing import Dict, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Отпечаток в имени файла меняется вместе с содержимым, поэтому кэш бессрочный
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Обращения по исходному имени всегда перепроверяются по ETag
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+class Asset:
+    """Файл статики: тип, отпечаток и заранее сжатые варианты содержимого"""
+
+    __slots__ = ("content_type", "digest", "variants")
+
+    def __init__(self, content_type: str, digest: str, variants: Dict[str, bytes]):
+        self.content_type = content_type
+        self.digest = digest
+        self.variants = variants
+
+    def etag(self, encoding: str) -> str:
+        if encoding == "identity":
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+
+class StaticAssets:
+    """Статика с отпечатками содержимого в именах, собирается один раз при старте"""
+
+    def __init__(self, directory: str, prefix: str = "/static/"):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        # {исходный путь: URL с отпечатком}
+        self.urls: Dict[str, str] = {}
+        # {путь в запросе: (файл, можно ли кэшировать бессрочно)}
+        self.assets: Dict[str, Tuple[Asset, bool]] = {}
+        self._build()
+
+    def _build(self):
+        for path in sorted(self.directory.rglob("*")):
+            if not path.is_file():
+                continue
+            data = path.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            name = path.relative_to(self.directory).as_posix()
+            stem, dot, extension = name.rpartition(".")
+            hashed_name = f"{stem}.{digest}.{extension}" if dot else f"{name}.{digest}"
+
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            asset = Asset(content_type, digest, self._compress(data, content_type))
+            self.assets[hashed_name] = (asset, True)
+            self.assets[name] = (asset, False)
+            self.urls[name] = self.prefix + hashed_name
+
+    @staticmethod
+    def _compress(data: bytes, content_type: str) -> Dict[str, bytes]:
+        variants = {"identity": data}
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return variants
+        compressed = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(data, quality=11)
+        for encoding, body in compressed.items():
+            if len(body) < len(data):
+                variants[encoding] = body
+        return variants
+
+    def url(self, path: str) -> str:
+        """URL файла с отпечатком для шаблонов: static_url('style.css')"""
+        path = path.lstrip("/")
+        return self.urls.get(path, self.prefix + path)
+
+
+def choose_encoding(accept_encoding: str, variants: Dict[str, bytes]) -> str:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in variants and (encoding in accepted or "*" in accepted):
+            return encoding
+    return "identity"
+
+
+class StaticAssetsMiddleware:
+    """Отдает статику из памяти до остального стека middleware"""
+
+    def __init__(self, app, assets: StaticAssets):
+        self.app = app
+        self.assets = assets
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        entry = None
+        if path.startswith(self.assets.prefix):
+            entry = self.assets.assets.get(path[len(self.assets.prefix):])
+        if entry is None:
+            await self.app(scope, receive, send)
+            return
+
+        asset, immutable = entry
+        request_headers = Headers(scope=scope)
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""), asset.variants)
+        etag = asset.etag(encoding)
+        headers = {
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+        }
+
+        if_none_match = request_headers.get("if-none-match", "")
+        if if_none_match == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]:
+            response = Response(status_code=304, headers=headers)
+        else:
+            if encoding != "identity":
+                headers["Content-Encoding"] = encoding
+            response = Response(asset.variants[encoding], headers=headers, media_type=asset.content_type)
+        await response(scope, receive, send)
@@ -4,10 +4,14 @@ from datetime import datetime, timedelta
 from fastapi import Request, HTTPException, Depends
 from fastapi.responses import JSONResponse, Response
 from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, get_async_db
 from models import User, ChatRoom
+from cache import TTLCache
+from sqlalchemy import event
 from fastapi.security import OAuth2PasswordBearer
 import hashlib
+import os
 from jose import jwt, JWTError
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -15,6 +19,19 @@ SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Кэш пользователей для токенов без email в claims: {user_id: {"user_id", "email"}}.
+# Изменения через ORM в этом воркере сбрасывают запись сразу, в остальных воркерах
+# (и при изменениях в обход ORM) устаревшая запись живет не дольше USER_CACHE_TTL
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_cached_user(mapper, connection, target: User):
+    user_cache.invalidate(target.id)
+
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
@@ -39,7 +56,7 @@ def verify_jwt(token: str = Depends(oauth2_scheme)):
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
 
-def get_current_user(request: Request):
+def decode_access_token(request: Request) -> dict:
     token = request.cookies.get("access_token")  # Теперь берем токен из Cookies
     if not token:
         raise HTTPException(status_code=401, detail="Не найден токен авторизации")
@@ -49,11 +66,30 @@ def get_current_user(request: Request):
         user_id: int = payload.get("user_id")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Неверный токен")
-        return {"user_id": user_id}
+        return payload
     except JWTError:
         raise HTTPException(status_code=401, detail="Токен недействителен")
 
 
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_async_db)) -> dict:
+    """Пользователь запроса: из подписанных claims, без обращения к базе.
+    Для токенов без email - из кэша пользователей, при промахе из базы"""
+    payload = decode_access_token(request)
+    user_id = payload["user_id"]
+    email = payload.get("email")
+    if email is not None:
+        return {"user_id": user_id, "email": email}
+
+    identity = user_cache.get(user_id)
+    if identity is None:
+        user = await db.get(User, user_id)
+        if not user:
+            raise HTTPException(status_code=401, detail="Пользователь не найден")
+        identity = {"user_id": user.id, "email": user.email}
+        user_cache.set(user_id, identity)
+    return identity
+
+
 def create_session(response: Response, user: User) -> str:  # Изменяем параметр с user_id на user
     expiration = datetime.utcnow() + timedelta(hours=2)
     token = jwt.encode(
@@ -1,16 +1,82 @@
 # website/database.py
+import os
+import time
 from sqlalchemy import create_engine, Column, Integer, String, ForeignKey
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from metrics import POOL_WAIT_SECONDS, instrument_engine
 
-DATABASE_URL = "postgresql://user:password@db:5432/chat_db"
-engine = create_engine(DATABASE_URL)
+DATABASE_URL = URL.create(
+    "postgresql",
+    username=os.getenv("DB_USER", "user"),
+    password=os.getenv("DB_PASSWORD", "password"),
+    host=os.getenv("DB_HOST", "db"),
+    port=int(os.getenv("DB_PORT", "5432")),
+    database=os.getenv("DB_NAME", "chat_db"),
+)
+ASYNC_DATABASE_URL = DATABASE_URL.set(drivername="postgresql+asyncpg")
+
+# Настройки пула соединений, общие для синхронного и асинхронного движков
+POOL_OPTIONS = {
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_pre_ping": True,
+}
+# У каждого движка свой пул, воркер держит до суммы обоих (по умолчанию 30 соединений).
+# Большинство обработчиков асинхронные, синхронным достается меньшая часть
+SYNC_POOL_SIZE = int(os.getenv("DB_SYNC_POOL_SIZE", "3"))
+SYNC_MAX_OVERFLOW = int(os.getenv("DB_SYNC_MAX_OVERFLOW", "7"))
+ASYNC_POOL_SIZE = int(os.getenv("DB_ASYNC_POOL_SIZE", "7"))
+ASYNC_MAX_OVERFLOW = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", "13"))
+
+
+
+class TimedQueuePool(QueuePool):
+    """Пул, замеряющий ожидание свободного соединения"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT_SECONDS.labels("sync").observe(time.perf_counter() - started)
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT_SECONDS.labels("async").observe(time.perf_counter() - started)
+
+
+engine = create_engine(
+    DATABASE_URL, poolclass=TimedQueuePool,
+    pool_size=SYNC_POOL_SIZE, max_overflow=SYNC_MAX_OVERFLOW, **POOL_OPTIONS
+)
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Асинхронный движок для обработчиков, которые не должны блокировать event loop
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, poolclass=TimedAsyncQueuePool,
+    pool_size=ASYNC_POOL_SIZE, max_overflow=ASYNC_MAX_OVERFLOW, **POOL_OPTIONS
+)
+instrument_engine(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
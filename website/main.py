@@ -1,10 +1,15 @@
 # website/main.py
-from fastapi import FastAPI, Depends, Request, Form, HTTPException, Path, Query, WebSocket, Cookie
+from fastapi import FastAPI, Depends, Request, Form, HTTPException, Path, Query, WebSocket
 from fastapi.responses import HTMLResponse, RedirectResponse
 from sqlalchemy.orm import Session
-from database import get_db, engine
-from models import Base, User, ChatRoom
-from auth import get_current_user, create_session, destroy_session, verify_jwt, hash_password, verify_password, SECRET_KEY, ALGORITHM
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import insert, select, func, or_, and_
+from database import get_db, get_async_db, engine, async_engine
+from models import Base, User, ChatRoom, Message
+from assets import StaticAssets, StaticAssetsMiddleware
+from metrics import MetricsMiddleware, metrics_response
+from outbox import outbox_relay, room_event, ROOM_CREATED, ROOM_DELETED
+from auth import get_current_user, decode_access_token, create_session, destroy_session, verify_jwt, hash_password, verify_password, SECRET_KEY, ALGORITHM
 from fastapi.templating import Jinja2Templates
 from fastapi import APIRouter
 from fastapi.staticfiles import StaticFiles
@@ -16,12 +21,70 @@ import httpx
 import json
 import secrets  # Для генерации секретного ключа
 import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, List, Optional
+from urllib.parse import urlencode
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+CHAT_SERVICE_URL = os.getenv("CHAT_SERVICE_URL", "http://chat:8001")
+# Параметры пула соединений к chat, те же переменные, что у клиента chat к website
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "5"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "2"))
+# Максимум имен в одном пакетном запросе проверки существования
+CHATS_EXISTS_BATCH_LIMIT = 1000
+# Размер страницы истории сообщений
+HISTORY_PAGE_SIZE = 50
+HISTORY_PAGE_SIZE_MAX = 200
+# Размер страницы поиска и число подсказок автодополнения
+SEARCH_PAGE_SIZE = 20
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_LIMIT_MAX = 50
+# Размер страницы списка имен чатов для прогрева реестра комнат в chat
+ROOM_NAMES_PAGE_SIZE = 1000
+ROOM_NAMES_PAGE_SIZE_MAX = 5000
+# Ожидание ответа chat о числе участников: список чатов не должен зависеть от chat
+OCCUPANCY_TIMEOUT = float(os.getenv("OCCUPANCY_TIMEOUT", "0.5"))
 Base.metadata.create_all(bind=engine)
-app = FastAPI()
+# create_all не добавляет новые индексы к уже существующим таблицам
+for index in ChatRoom.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
+
+def escape_like(value: str) -> str:
+    """Экранирование спецсимволов LIKE в пользовательском запросе"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Один клиент к chat на все время жизни приложения с keep-alive пулом
+    app.state.chat_client = httpx.AsyncClient(
+        base_url=CHAT_SERVICE_URL,
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+    # События комнат из outbox доставляются в chat в фоне
+    outbox_relay.start(app.state.chat_client)
+    yield
+    await outbox_relay.stop()
+    await app.state.chat_client.aclose()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Добавляем middleware для сессий
 app.add_middleware(
@@ -42,22 +105,21 @@ templates = Jinja2Templates(directory="templates")
 router = APIRouter()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Задержка запросов и время в БД по шаблонам маршрутов
+app.add_middleware(MetricsMiddleware)
 
-@app.middleware("http")
-async def add_cache_control_header(request, call_next):
-    response = await call_next(request)
-    if "/static/" in request.url.path:
-        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-        response.headers["Pragma"] = "no-cache"
-        response.headers["Expires"] = "0"
-    return response
+# Статика с отпечатками в именах и заранее сжатыми вариантами.
+# Middleware добавлен последним, поэтому отвечает раньше сессий и CORS
+static_assets = StaticAssets("static")
+templates.env.globals["static_url"] = static_assets.url
+app.add_middleware(StaticAssetsMiddleware, assets=static_assets)
 
 
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request, db: Session = Depends(get_db)):
     user = None
     try:
-        user = get_current_user(request)
+        user = decode_access_token(request)
     except HTTPException:
         pass  # Игнорируем ошибку 401
 
@@ -127,16 +189,37 @@ def register(
     return RedirectResponse(url="/", status_code=303)
 
 
+async def fetch_occupancy(request: Request, names: List[str]) -> Dict[str, int]:
+    """Число участников в комнатах от chat, без него страница показывается без счетчиков"""
+    if not names:
+        return {}
+    try:
+        response = await request.app.state.chat_client.post(
+            "/rooms/occupancy", json={"names": names}, timeout=OCCUPANCY_TIMEOUT
+        )
+        response.raise_for_status()
+        return response.json().get("occupancy", {})
+    except Exception as e:
+        logger.warning(f"Failed to load room occupancy: {e}")
+        return {}
+
+
 @app.get("/chats", response_class=HTMLResponse)
-def chat_list(request: Request, db: Session = Depends(get_db), user: dict = Depends(get_current_user)):
+async def chat_list(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    user: dict = Depends(get_current_user)
+):
     # Получаем только чаты, созданные текущим пользователем
-    chats = db.query(ChatRoom).filter(ChatRoom.owner_id == user["user_id"]).all()
+    chats = (await db.scalars(select(ChatRoom).where(ChatRoom.owner_id == user["user_id"]))).all()
+    occupancy = await fetch_occupancy(request, [chat.name for chat in chats])
     return templates.TemplateResponse(
         "chats.html", 
         {
             "request": request, 
             "chats": chats, 
-            "user": user
+            "user": user,
+            "occupancy": occupancy
         }
     )
 
@@ -163,39 +246,34 @@ def create_chat(
     # Создаем новый чат
     new_chat = ChatRoom(name=name, owner_id=user["user_id"])
     db.add(new_chat)
+    db.add(room_event(ROOM_CREATED, name))
     db.commit()
+    outbox_relay.wake()
     return RedirectResponse(url="/chats", status_code=303)
 
 @app.post("/chats/{chat_id}/delete")
 async def delete_chat(
     chat_id: int,
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: dict = Depends(get_current_user)
 ):
-    chat = db.query(ChatRoom).filter(ChatRoom.id == chat_id).first()
+    chat = await db.get(ChatRoom, chat_id)
     if not chat or chat.owner_id != user["user_id"]:
         raise HTTPException(status_code=403, detail="Нет прав на удаление чата")
 
     try:
-        # Сначала отправляем уведомление всем пользователям чата
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            try:
-                await client.post(
-                    f"http://chat:8000/notify_delete/{chat.name}",
-                    json={"message": "Чат был удален создателем"}
-                )
-            except Exception as e:
-                print(f"Failed to notify chat service: {e}")
-
-        # Удаляем чат из базы
-        db.delete(chat)
-        db.commit()
-        
+        # Удаляем чат из базы; уведомление для chat пишется в outbox в той же транзакции
+        # и доставляется в фоне, даже если chat сейчас недоступен
+        await db.delete(chat)
+        db.add(room_event(ROOM_DELETED, chat.name, message="Чат был удален создателем"))
+        await db.commit()
+        outbox_relay.wake()
+
         return RedirectResponse(url="/chats", status_code=303)
     except Exception as e:
-        print(f"Error deleting chat: {e}")
-        db.rollback()
+        logger.error(f"Error deleting chat: {e}")
+        await db.rollback()
         return RedirectResponse(url="/chats?error=Ошибка при удалении чата", status_code=303)
 
 
@@ -203,37 +281,71 @@ async def delete_chat(
 async def chat(
     request: Request,
     room_name: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: dict = Depends(get_current_user)
 ):
     # Проверяем существование чата
-    chat = db.query(ChatRoom).filter(ChatRoom.name == room_name).first()
-    if not chat:
+    chat_id = await db.scalar(select(ChatRoom.id).where(ChatRoom.name == room_name))
+    if chat_id is None:
         return RedirectResponse(
             url="/chats?error=Чат не существует или был удален",
             status_code=303
         )
     
-    # Получаем пользователя из базы данных для получения email
-    db_user = db.query(User).filter(User.id == user["user_id"]).first()
-    
+    # Email уже есть в claims токена, в базу за пользователем не ходим
     return templates.TemplateResponse(
         "chat.html",
         {
             "request": request,
             "room_name": room_name,
             "user": {
-                "email": db_user.email
+                "email": user["email"]
             }
         }
     )
 
 
+@app.get("/api/chat/{room_name}/messages")
+async def chat_history(
+    room_name: str,
+    before_id: Optional[int] = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_SIZE_MAX),
+    db: AsyncSession = Depends(get_async_db),
+    user: dict = Depends(get_current_user)
+):
+    """История сообщений чата, от новых к старым, с keyset-пагинацией по (room_id, id)"""
+    chat_id = await db.scalar(select(ChatRoom.id).where(ChatRoom.name == room_name))
+    if chat_id is None:
+        raise HTTPException(status_code=404, detail="Чат не найден")
+
+    query = select(Message).where(Message.room_id == chat_id)
+    if before_id is not None:
+        query = query.where(Message.id < before_id)
+    messages = (await db.scalars(query.order_by(Message.id.desc()).limit(limit))).all()
+
+    return {
+        "messages": [
+            {
+                "id": message.id,
+                "type": "message",
+                "user": message.user_email,
+                "message": message.text,
+                "created_at": message.created_at.isoformat()
+            }
+            for message in messages
+        ],
+        # Курсор следующей страницы, None - история закончилась
+        "next_before_id": messages[-1].id if len(messages) == limit else None
+    }
+
+
 @app.get("/chats/search")
 async def search_chats(
     request: Request,
     query: str,
-    db: Session = Depends(get_db),
+    after_rank: Optional[float] = None,
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
     user: dict = Depends(get_current_user)
 ):
     if len(query) < 6:
@@ -242,10 +354,29 @@ async def search_chats(
             status_code=303
         )
 
-    # Поиск чатов, содержащих запрос (без учета регистра)
-    matching_chats = db.query(ChatRoom).filter(
-        ChatRoom.name.ilike(f"%{query}%")
-    ).all()
+    # Поиск чатов, содержащих запрос (без учета регистра), по триграммному индексу.
+    # Сначала самые похожие, keyset-пагинация по (rank, id)
+    rank = func.similarity(ChatRoom.name, query).label("rank")
+    statement = select(ChatRoom, rank).where(
+        ChatRoom.name.ilike(f"%{escape_like(query)}%", escape="\\")
+    )
+    if after_rank is not None and after_id is not None:
+        statement = statement.where(or_(
+            rank < after_rank,
+            and_(rank == after_rank, ChatRoom.id > after_id)
+        ))
+    rows = (await db.execute(
+        statement.order_by(rank.desc(), ChatRoom.id).limit(SEARCH_PAGE_SIZE)
+    )).all()
+    matching_chats = [chat for chat, _ in rows]
+    occupancy = await fetch_occupancy(request, [chat.name for chat in matching_chats])
+
+    next_url = None
+    if len(rows) == SEARCH_PAGE_SIZE:
+        last_chat, last_rank = rows[-1]
+        next_url = "/chats/search?" + urlencode(
+            {"query": query, "after_rank": repr(last_rank), "after_id": last_chat.id}
+        )
 
     return templates.TemplateResponse(
         "chats.html",
@@ -253,11 +384,31 @@ async def search_chats(
             "request": request,
             "chats": matching_chats,
             "user": user,
-            "search_query": query
+            "search_query": query,
+            "next_url": next_url,
+            "occupancy": occupancy
         }
     )
 
 
+@app.get("/api/chats/autocomplete")
+async def autocomplete_chats(
+    prefix: str = Query(..., min_length=1),
+    limit: int = Query(AUTOCOMPLETE_LIMIT, ge=1, le=AUTOCOMPLETE_LIMIT_MAX),
+    db: AsyncSession = Depends(get_async_db),
+    user: dict = Depends(get_current_user)
+):
+    """Подсказки названий чатов по префиксу: один проход по индексу на lower(name)"""
+    lower_name = func.lower(ChatRoom.name).collate("C")
+    names = (await db.scalars(
+        select(ChatRoom.name)
+        .where(lower_name.like(f"{escape_like(prefix.lower())}%", escape="\\"))
+        .order_by(lower_name)
+        .limit(limit)
+    )).all()
+    return {"names": names}
+
+
 @app.get("/chats/{room_name}")
 def get_chat_by_name(
     room_name: str,
@@ -280,52 +431,24 @@ def get_chat_by_name(
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-# Обновим также функцию get_current_user, чтобы она возвращала email
-def get_current_user(request: Request, db: Session = Depends(get_db)):
-    user_id = request.session.get("user_id")
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Не авторизован")
-    
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="Пользователь не найден")
-    
-    return {
-        "user_id": user.id,
-        "email": user.email  # Добавляем email в возвращаемый словарь
-    }
-
 @app.get("/get_chat_token/{room_name}")
 async def get_chat_token(
     request: Request,
     room_name: str,
-    db: Session = Depends(get_db),
-    access_token: Optional[str] = Cookie(None)
+    db: AsyncSession = Depends(get_async_db),
+    user: dict = Depends(get_current_user)
 ):
     """Получение токена для WebSocket подключения"""
     try:
-        if not access_token:
-            raise HTTPException(status_code=401, detail="Не авторизован")
-
-        # Проверяем токен пользователя
-        try:
-            payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
-            user_id = payload.get("user_id")
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                raise HTTPException(status_code=401, detail="Пользователь не найден")
-        except jwt.JWTError:
-            raise HTTPException(status_code=401, detail="Недействительный токен")
-
         # Проверяем существование чата
-        chat = db.query(ChatRoom).filter(ChatRoom.name == room_name).first()
-        if not chat:
+        chat_id = await db.scalar(select(ChatRoom.id).where(ChatRoom.name == room_name))
+        if chat_id is None:
             raise HTTPException(status_code=404, detail="Чат не найден")
 
         # Создаем токен для WebSocket
         token_data = {
-            "user_id": user.id,
-            "email": user.email,
+            "user_id": user["user_id"],
+            "email": user["email"],
             "chat_name": room_name,
             "exp": datetime.utcnow() + timedelta(hours=1)
         }
@@ -336,14 +459,94 @@ async def get_chat_token(
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"Error generating chat token: {e}")
+        logger.error(f"Error generating chat token: {e}")
         raise HTTPException(status_code=500, detail="Ошибка генерации токена")
 
 @app.get("/api/chat/{room_name}/exists")
 async def check_chat_exists(
     room_name: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Проверка существования чата"""
-    chat = db.query(ChatRoom).filter(ChatRoom.name == room_name).first()
-    return {"exists": chat is not None}
\ No newline at end of file
+    chat_id = await db.scalar(select(ChatRoom.id).where(ChatRoom.name == room_name))
+    return {"exists": chat_id is not None}
+
+
+@app.get("/api/internal/chats/names")
+async def list_chat_names(
+    after_id: Optional[int] = None,
+    limit: int = Query(ROOM_NAMES_PAGE_SIZE, ge=1, le=ROOM_NAMES_PAGE_SIZE_MAX),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Имена чатов для прогрева реестра комнат в chat, keyset-пагинация по id"""
+    query = select(ChatRoom.id, ChatRoom.name)
+    if after_id is not None:
+        query = query.where(ChatRoom.id > after_id)
+    rows = (await db.execute(query.order_by(ChatRoom.id).limit(limit))).all()
+    return {
+        "names": [name for _, name in rows],
+        # Курсор следующей страницы, None - имена закончились
+        "next_after_id": rows[-1][0] if len(rows) == limit else None
+    }
+
+
+class ChatNames(BaseModel):
+    names: List[str]
+
+
+@app.post("/api/chats/exists")
+async def check_chats_exist(
+    body: ChatNames,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Пакетная проверка существования чатов одним запросом"""
+    if len(body.names) > CHATS_EXISTS_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail="Слишком много имен в запросе")
+    found = set(
+        (await db.scalars(select(ChatRoom.name).where(ChatRoom.name.in_(body.names)))).all()
+    )
+    return {"exists": {name: name in found for name in body.names}}
+
+
+class StoredMessage(BaseModel):
+    room: str
+    user: str
+    message: str
+    created_at: float
+
+
+class MessageBatch(BaseModel):
+    messages: List[StoredMessage]
+
+
+@app.post("/api/internal/messages")
+async def store_messages(
+    body: MessageBatch,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Пакетная запись сообщений от chat одним многострочным INSERT"""
+    names = {message.room for message in body.messages}
+    room_ids = dict(
+        (await db.execute(select(ChatRoom.name, ChatRoom.id).where(ChatRoom.name.in_(names)))).all()
+    )
+    # Сообщения уже удаленных чатов отбрасываем
+    rows = [
+        {
+            "room_id": room_ids[message.room],
+            "user_email": message.user,
+            "text": message.message,
+            "created_at": datetime.utcfromtimestamp(message.created_at)
+        }
+        for message in body.messages
+        if message.room in room_ids
+    ]
+    if rows:
+        await db.execute(insert(Message), rows)
+        await db.commit()
+    return {"stored": len(rows)}
+
+
+@app.get("/metrics")
+def metrics():
+    """Метрики в формате Prometheus, снаружи закрыты в nginx"""
+    return metrics_response()
@@ -0,0 +1,115 @@
+# website/metrics.py
+import time
+from contextvars import ContextVar
+from typing import List, Optional
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from sqlalchemy import event
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+REQUEST_SECONDS = Histogram(
+    "website_request_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"], buckets=REQUEST_BUCKETS,
+)
+DB_SECONDS = Histogram(
+    "website_db_seconds", "Total database query time per request by route",
+    ["route"], buckets=QUERY_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    "website_db_queries", "Database queries per request by route",
+    ["route"], buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+POOL_WAIT_SECONDS = Histogram(
+    "website_db_pool_wait_seconds", "Time spent waiting for a pooled connection",
+    ["engine"], buckets=QUERY_BUCKETS,
+)
+OUTBOX_DELIVERED = Counter(
+    "website_outbox_delivered_total", "Room events delivered from the outbox to chat"
+)
+OUTBOX_FAILURES = Counter(
+    "website_outbox_failures_total", "Failed outbox batch deliveries to chat"
+)
+OUTBOX_LAG_SECONDS = Histogram(
+    "website_outbox_lag_seconds", "Time from writing a room event to its delivery to chat",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+
+
+class RequestTimings:
+    """Время запросов к БД в рамках одного HTTP-запроса"""
+
+    __slots__ = ("db_seconds", "queries")
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.queries = 0
+
+
+# Обработчики и зависимости в пуле потоков получают копию контекста,
+# поэтому изменяемый объект виден middleware после ответа
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started: List[float] = conn.info["query_started"]
+    elapsed = time.perf_counter() - started.pop()
+    timings = request_timings.get()
+    if timings is not None:
+        timings.db_seconds += elapsed
+        timings.queries += 1
+
+
+def instrument_engine(sync_engine):
+    """Учет времени запросов движка (для асинхронного - его sync_engine)"""
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def route_name(scope) -> str:
+    # Шаблон пути, а не сам путь, чтобы число серий не зависело от имен комнат
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Задержка каждого запроса и время, проведенное им в БД"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_timings.reset(token)
+            route = route_name(scope)
+            REQUEST_SECONDS.labels(scope["method"], route, status).observe(elapsed)
+            DB_SECONDS.labels(route).observe(timings.db_seconds)
+            DB_QUERIES.labels(route).observe(timings.queries)
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
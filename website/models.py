@@ -1,6 +1,7 @@
 # website/models.py
+from datetime import datetime
 from database import Base
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, Index, DDL, event, func
 
 class User(Base):
     __tablename__ = "users"
@@ -15,3 +16,43 @@ class ChatRoom(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
     owner_id = Column(Integer, ForeignKey("users.id"))
+
+# Триграммы для поиска по подстроке и ранжирования по похожести названия
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
+Index(
+    "ix_chat_rooms_name_trgm",
+    ChatRoom.name,
+    postgresql_using="gin",
+    postgresql_ops={"name": "gin_trgm_ops"}
+)
+# Автодополнение по префиксу без учета регистра: побайтовый порядок "C"
+# позволяет одному индексу обслужить и LIKE 'prefix%', и сортировку
+Index("ix_chat_rooms_lower_name_prefix", func.lower(ChatRoom.name).collate("C"))
+
+class Message(Base):
+    __tablename__ = "messages"
+    # Индекс под keyset-пагинацию истории: WHERE room_id = ? AND id < ? ORDER BY id DESC
+    __table_args__ = (Index("ix_messages_room_id_id", "room_id", "id"),)
+
+    id = Column(BigInteger, primary_key=True)
+    room_id = Column(Integer, ForeignKey("chat_rooms.id", ondelete="CASCADE"), nullable=False)
+    user_email = Column(String, nullable=False)
+    text = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class OutboxEvent(Base):
+    """События комнат для chat: пишутся в одной транзакции с изменением ChatRoom,
+    доставляются фоновым релеем по порядку id и удаляются после подтверждения"""
+    __tablename__ = "outbox_events"
+
+    id = Column(BigInteger, primary_key=True)
+    event_type = Column(String, nullable=False)
+    room_name = Column(String, nullable=False)
+    payload = Column(Text, nullable=False, default="{}")
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Пакет с событием отправляется в chat до этого момента, потом его можно отправить снова
+    locked_until = Column(DateTime, nullable=True)
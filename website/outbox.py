@@ -0,0 +1,169 @@
+# website/outbox.py
+import asyncio
+import json
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import httpx
+from sqlalchemy import delete, select, text, update
+
+from database import AsyncSessionLocal
+from metrics import OUTBOX_DELIVERED, OUTBOX_FAILURES, OUTBOX_LAG_SECONDS
+from models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+ROOM_CREATED = "room_created"
+ROOM_DELETED = "room_deleted"
+
+# Максимум событий в одном запросе к chat
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+# Проверка таблицы без сигнала от обработчиков (секунды): события других воркеров и оставшиеся после рестарта
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+# Задержка повтора при недоступном chat растет от минимальной до максимальной (секунды)
+OUTBOX_RETRY_MIN_DELAY = float(os.getenv("OUTBOX_RETRY_MIN_DELAY", "0.5"))
+OUTBOX_RETRY_MAX_DELAY = float(os.getenv("OUTBOX_RETRY_MAX_DELAY", "30"))
+OUTBOX_TIMEOUT = float(os.getenv("OUTBOX_TIMEOUT", "5"))
+# Сколько пакет считается отправляемым (секунды), больше OUTBOX_TIMEOUT: если воркер
+# упал посреди отправки, после этого срока пакет отправит другой
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "15"))
+# Ключ advisory-блокировки на время выбора пакета: в полете не больше одного пакета,
+# чтобы не нарушить порядок
+OUTBOX_LOCK_ID = 7461001
+
+
+def room_event(event_type: str, room_name: str, **payload) -> OutboxEvent:
+    """Событие комнаты, добавляется в сессию вместе с изменением ChatRoom"""
+    return OutboxEvent(
+        event_type=event_type,
+        room_name=room_name,
+        payload=json.dumps(payload, ensure_ascii=False),
+    )
+
+
+class OutboxRelay:
+    """Фоновая доставка событий outbox в chat пакетами по порядку id.
+    Событие удаляется только после ответа chat; повтор безопасен, chat пропускает уже примененные id"""
+
+    def __init__(self):
+        self.client: Optional[httpx.AsyncClient] = None
+        self.task: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def start(self, client: httpx.AsyncClient):
+        self.client = client
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    def wake(self):
+        """Событие закоммичено: отправить, не дожидаясь опроса. Можно вызывать из потока синхронного обработчика"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def _run(self):
+        delay = OUTBOX_RETRY_MIN_DELAY
+        while True:
+            try:
+                sent = await self.relay_batch()
+            except Exception as e:
+                OUTBOX_FAILURES.inc()
+                logger.warning(f"Failed to relay outbox events: {e}")
+                # Разброс, чтобы воркеры website не повторяли одновременно
+                await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2))
+                delay = min(delay * 2, OUTBOX_RETRY_MAX_DELAY)
+                continue
+            delay = OUTBOX_RETRY_MIN_DELAY
+            if sent < OUTBOX_BATCH_SIZE:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), OUTBOX_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+
+    async def relay_batch(self) -> int:
+        """Отправка самых старых событий одним запросом, возвращает число доставленных.
+        Транзакции короткие: соединение с БД не держится, пока идет запрос к chat"""
+        events = await self._lease()
+        if not events:
+            return 0
+        ids = [event.id for event in events]
+        try:
+            response = await self.client.post(
+                "/api/internal/room-events",
+                json={"events": [
+                    {
+                        "id": event.id,
+                        "type": event.event_type,
+                        "room": event.room_name,
+                        "payload": json.loads(event.payload),
+                    }
+                    for event in events
+                ]},
+                timeout=OUTBOX_TIMEOUT,
+            )
+            response.raise_for_status()
+        except Exception:
+            await self._release(ids)
+            raise
+        # Не удалось удалить после ответа chat - пакет уйдет повторно и будет пропущен по id
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                await db.execute(delete(OutboxEvent).where(OutboxEvent.id.in_(ids)))
+        now = datetime.utcnow()
+        for event in events:
+            OUTBOX_LAG_SECONDS.observe((now - event.created_at).total_seconds())
+        OUTBOX_DELIVERED.inc(len(events))
+        return len(events)
+
+    async def _lease(self) -> List[OutboxEvent]:
+        """Выбор самых старых событий и отметка их как отправляемых"""
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                # Блокировка держится до конца транзакции; занята - пакет выбирает другой воркер
+                locked = await db.scalar(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": OUTBOX_LOCK_ID})
+                if not locked:
+                    return []
+                now = datetime.utcnow()
+                # Пакет уже в полете: следующий уйдет после него
+                in_flight = await db.scalar(
+                    select(OutboxEvent.id).where(OutboxEvent.locked_until > now).limit(1)
+                )
+                if in_flight is not None:
+                    return []
+                events = (await db.scalars(
+                    select(OutboxEvent).order_by(OutboxEvent.id).limit(OUTBOX_BATCH_SIZE)
+                )).all()
+                if events:
+                    await db.execute(
+                        update(OutboxEvent)
+                        .where(OutboxEvent.id.in_([event.id for event in events]))
+                        .values(locked_until=now + timedelta(seconds=OUTBOX_LEASE))
+                    )
+        return events
+
+    async def _release(self, ids: List[int]):
+        """chat не принял пакет: повтор не ждет истечения срока"""
+        try:
+            async with AsyncSessionLocal() as db:
+                async with db.begin():
+                    await db.execute(update(OutboxEvent).where(OutboxEvent.id.in_(ids)).values(locked_until=None))
+        except Exception as e:
+            logger.warning(f"Failed to release outbox events: {e}")
+
+
+outbox_relay = OutboxRelay()